@@ -3,18 +3,186 @@
 import os
 import sys
 import pluggy
+import importlib.util
 import shutil
 import random
 import re
 import datetime
+import json
 import pytest
 import glob
+import queue
+import threading
+import hashlib
+import concurrent.futures
 
 from river_core.log import logger
 from river_core.utils import *
 
 dut_hookimpl = pluggy.HookimplMarker('dut')
 
+# Test scheduling shared by the plugins, an identical copy of scheduling.py
+# is kept next to every plugin
+scheduling_spec = importlib.util.spec_from_file_location(
+    __name__ + '_scheduling',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scheduling.py'))
+scheduling = importlib.util.module_from_spec(scheduling_spec)
+scheduling_spec.loader.exec_module(scheduling)
+
+
+def hash_paths(paths, *args):
+    '''
+        Compute a sha256 digest over a list of strings and the contents of
+        files. Directories are walked recursively in a stable order so that
+        the digest only changes when the content (or layout) changes.
+
+        :param paths: List of files/directories to hash
+
+        :param args: Extra values (command lines, versions) to mix into the digest
+
+        :returns: hex digest
+
+        :rtype: str
+    '''
+    digest = hashlib.sha256()
+    for arg in args:
+        digest.update(str(arg).encode())
+        digest.update(b'\0')
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, x) for x in sorted(names))
+            base = path
+        else:
+            files = [path]
+            base = os.path.dirname(path)
+        for name in files:
+            digest.update(os.path.relpath(name, base).encode())
+            digest.update(b'\0')
+            if not os.path.isfile(name):
+                continue
+            with open(name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+
+def merge_coverage(cov_files, final_cov_file, jobs, fan_in=64):
+    '''
+        Function to merge verilator coverage files in a tree. The files are
+        merged in groups of fan_in files, up to jobs groups at a time, and
+        the intermediate files are merged again until a single group is
+        left, which is merged into final_cov_file. As verilator_coverage
+        adds up the counts of the files, the result is the same as merging
+        every file at once.
+
+        :param cov_files: coverage files of the tests
+
+        :param final_cov_file: merged coverage file
+
+        :param jobs: number of merges run in parallel
+
+        :param fan_in: number of files merged by a single verilator_coverage
+
+        :type cov_files: list
+
+        :type final_cov_file: str
+
+        :type jobs: int
+
+        :type fan_in: int
+
+        :return: True if every merge succeeded
+
+        :rtype: bool
+    '''
+    merge_dir = final_cov_file + '.merge'
+    shutil.rmtree(merge_dir, ignore_errors=True)
+    os.makedirs(merge_dir)
+
+    def merge(output, inputs):
+        (ret, out, err) = sys_command(
+            'verilator_coverage -write {0} {1}'.format(output,
+                                                       ' '.join(inputs)))
+        if ret != 0:
+            logger.error('Merging coverage into {0} failed'.format(output))
+        return ret == 0
+
+    success = True
+    level = 0
+    while len(cov_files) > fan_in:
+        groups = [
+            cov_files[index:index + fan_in]
+            for index in range(0, len(cov_files), fan_in)
+        ]
+        outputs = [
+            '{0}/level{1}_{2}.dat'.format(merge_dir, level, index)
+            for index in range(len(groups))
+        ]
+        logger.info('Merging {0} coverage files in {1} groups'.format(
+            len(cov_files), len(groups)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            success = all(pool.map(merge, outputs, groups)) and success
+        cov_files = outputs
+        level += 1
+    success = merge(final_cov_file, cov_files) and success
+    shutil.rmtree(merge_dir, ignore_errors=True)
+    return success
+
+
+class CoverageMerger(object):
+    '''
+        Pytest plugin merging the coverage of every test into a running
+        aggregate as soon as the test finishes. The merges are done one at a
+        time by a background thread so that the dispatch of the tests is not
+        held up.
+
+        :param fold: function merging the coverage of a test, given its name,
+            into the aggregate and returning True when it was merged
+
+        :type fold: function
+    '''
+
+    def __init__(self, fold):
+        self.fold = fold
+        self.merged = set()
+        self.tests = queue.Queue()
+        self.thread = threading.Thread(target=self.merge_tests, daemon=True)
+        self.thread.start()
+
+    def pytest_runtest_logreport(self, report):
+        # With xdist the reports of the workers are passed on to this hook in
+        # the controlling process
+        if report.when == 'call':
+            self.tests.put(report.nodeid.rsplit('[', 1)[-1][:-1])
+
+    def merge_tests(self):
+        while True:
+            test = self.tests.get()
+            if test is None:
+                break
+            try:
+                if self.fold(test):
+                    self.merged.add(test)
+            except Exception as e:
+                logger.error('Merging coverage of {0} failed: {1}'.format(
+                    test, e))
+
+    def finish(self):
+        '''
+            Wait for the pending merges to complete
+
+            :return: names of the tests whose coverage is in the aggregate
+
+            :rtype: set
+        '''
+        self.tests.put(None)
+        self.thread.join()
+        return self.merged
+
 
 class azurite_verilator_plugin(object):
     '''
@@ -33,6 +201,11 @@ class azurite_verilator_plugin(object):
             self.stop_on_failure = ini_config['stop_on_failure']
         else:
             self.stop_on_failure = False
+        # Persistent cache for artifacts which can be reused across runs
+        if 'cache_dir' in ini_config:
+            self.cache_dir = os.path.abspath(ini_config['cache_dir'])
+        else:
+            self.cache_dir = os.path.abspath(work_dir) + '/.cache'
 
         self.top_module = ini_config['top_module']
 
@@ -60,6 +233,24 @@ class azurite_verilator_plugin(object):
 
         self.elfmem = ini_config['elfmem']
 
+        # Create code.mem holding only the populated words of the ELF
+        # instead of running elf2hex over the whole memory. The testbench
+        # then zeroes the memory, given as <module>.<variable> in
+        # sparse_mem_var, before loading the image (+sparsemem).
+        if 'sparse_mem' in ini_config:
+            self.sparse_mem = str_2_bool(ini_config['sparse_mem'])
+        else:
+            self.sparse_mem = False
+        if self.sparse_mem:
+            if '.' not in ini_config.get('sparse_mem_var', ''):
+                logger.error('sparse_mem needs the memory of the design as '
+                             'sparse_mem_var = <module>.<variable>')
+                raise SystemExit
+            self.sparse_mem_var = ini_config['sparse_mem_var'].strip().rsplit(
+                '.', 1)
+        self.elf2hex_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'elf2hex.py')
+
         if os.path.exists(f'{self.azurite_root}/build/debug_checked.yaml'):
             self.debug = True
         else:
@@ -71,15 +262,86 @@ class azurite_verilator_plugin(object):
             self.elf2hex_cmd = ''
             self.cpp_files += f' {self.azurite_root}/devices/elfmem/elfmem.cpp'
             self.sim_args = '+elf=dut.elf +rtldump > /dev/null'
+        elif self.sparse_mem:
+            self.elf2hex_cmd = '{0} {1} {2} dut.elf 2147483648 > code.mem'.format(self.elf2hex_script, str(int(self.xlen / 8)), filesize)
+            self.sim_args = '+sparsemem={0} +rtldump > /dev/null'.format(
+                self.sparse_mem_var[1])
         else:
-            self.elf2hex_cmd = 'elf2hex {0} {1} dut.elf 2147483648 > code.mem && '.format(str(int(self.xlen / 8)), filesize)
+            self.elf2hex_cmd = 'elf2hex {0} {1} dut.elf 2147483648 > code.mem'.format(str(int(self.xlen / 8)), filesize)
             self.sim_args = '+rtldump > /dev/null'
         if self.debug:
             self.cpp_files += f' {self.azurite_root}/devices/jtagdtm/remotebitbang.c'
-        self.objdump_cmd = ''#riscv{0}-unknown-elf-objdump -D dut.elf > dut.disass && '.format( self.xlen)
+        self.objdump_cmd = ''#riscv{0}-unknown-elf-objdump -D dut.elf > dut.disass'.format( self.xlen)
         self.sim_cmd = './azurite_core'
         self.clean_up = 'rm -f code.mem app_log signature'
-
+        # Self-checking tests report their result in the signature, which
+        # river_core checks as dut.signature instead of comparing the dumps
+        self.self_check_cmd = 'cp signature dut.signature'
+
+        # Tests are compiled once into a shared ELF in the test work_dir which
+        # is reused by the other plugins running the same test.
+        self.compile_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link dut.elf --'
+        # The ELFs of static suites, whose sources are the same in every
+        # regression, are also kept in a persistent cache bounded to
+        # elf_cache_size MB
+        if 'elf_cache' in ini_config:
+            self.elf_cache = str_2_bool(ini_config['elf_cache'])
+        else:
+            self.elf_cache = True
+        if 'elf_cache_generators' in ini_config:
+            self.elf_cache_generators = [
+                x.strip() for x in ini_config['elf_cache_generators'].split(',')
+            ]
+        else:
+            self.elf_cache_generators = ['riscv_tests', 'riscof', 'ctg']
+        if 'elf_cache_size' in ini_config:
+            self.elf_cache_size = int(ini_config['elf_cache_size'])
+        else:
+            self.elf_cache_size = 2048
+        self.elf_cache_dir = os.path.join(self.cache_dir, 'elf')
+        self.elf_cache_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link dut.elf --cache {0} --'.format(
+                self.elf_cache_dir)
+        # Run the tests which failed in the previous run and the smoke tests
+        # (comma separated fnmatch patterns of test names) ahead of the
+        # regression, in a pytest session of their own
+        if 'fast_feedback' in ini_config:
+            self.fast_feedback = str_2_bool(ini_config['fast_feedback'])
+        else:
+            self.fast_feedback = False
+        if 'smoke' in ini_config:
+            self.smoke = [
+                x.strip() for x in ini_config['smoke'].split(',') if x.strip()
+            ]
+        else:
+            self.smoke = []
+        # Merge the coverage of every test into a running aggregate while
+        # the regression runs instead of merging all of them at the end
+        if 'stream_coverage' in ini_config:
+            self.stream_coverage = str_2_bool(ini_config['stream_coverage'])
+        else:
+            self.stream_coverage = False
+        # The simulation of a test is skipped when its ELF, the simulator,
+        # the boot image and the simulator arguments are unchanged since a
+        # previous run. dut.dump (and the signature of self-checking tests)
+        # and the exit status are then restored from a persistent cache.
+        if 'result_cache' in ini_config:
+            self.result_cache = str_2_bool(ini_config['result_cache'])
+        else:
+            self.result_cache = False
+        if self.result_cache and self.coverage:
+            logger.warn('result_cache is ignored when coverage is enabled')
+            self.result_cache = False
+        if 'cache_size' in ini_config:
+            self.cache_size = int(ini_config['cache_size'])
+        else:
+            self.cache_size = 10240
+        self.result_cache_dir = os.path.join(self.cache_dir, self.name)
+        self.result_cache_script = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'result_cache.py')
         self.work_dir = os.path.abspath(work_dir) + '/'
 
         self.sim_path = self.work_dir + self.name
@@ -88,6 +350,8 @@ class azurite_verilator_plugin(object):
         self.test_list = load_yaml(test_list)
 
         self.json_dir = self.work_dir + '/.json/'
+        # Runtimes of the tests in previous runs, used to schedule them
+        self.history_file = self.json_dir + 'history_' + self.name + '.json'
 
         # Check if dir exists
         if (os.path.isdir(self.json_dir)):
@@ -103,7 +367,7 @@ class azurite_verilator_plugin(object):
             logger.error(f'Path: {self.azurite_root} does not exist')
             raise SystemExit
 
-        if shutil.which('elf2hex') is None:
+        if not (self.elfmem or self.sparse_mem) and shutil.which('elf2hex') is None:
             logger.error('elf2hex utility not found in $PATH')
             raise SystemExit
 
@@ -149,6 +413,15 @@ class azurite_verilator_plugin(object):
             )
             verilator_command = verilator_command.format('')
 
+        if self.sparse_mem:
+            # Only the memory is made public, so that the testbench can zero
+            # it without touching the reset of the rest of the design
+            with open(self.sim_path + '/sparse_mem.vlt', 'w') as vlt:
+                vlt.write('`verilator_config\n')
+                vlt.write('public_flat_rw -module "{0}" -var "{1}"\n'.format(
+                    *self.sparse_mem_var))
+            verilator_command += ' sparse_mem.vlt'
+
         # create simulation header files
         sim_header = open(self.sim_path + '/sim_main.h', 'w')
         sim_header.write('#define TOPMODULE V{0}\n'.format(self.top_module))
@@ -159,21 +432,57 @@ class azurite_verilator_plugin(object):
         shutil.copy(self.plugin_path + self.name + '_plugin/sim_main.cpp',
                     self.sim_path)
 
-        sys_command(verilator_command, 500)
-        logger.info("Linking verilator simulation sources")
+        # The binary only depends on the verilog sources, the testbench, the
+        # verilator command line and the verilator version. Reuse a previous
+        # build if none of them have changed.
+        (ret, verilator_version, err) = sys_command('verilator --version')
+        build_sources = [f'{self.azurite_root}/build/hw/verilog/',
+                         self.sim_path + '/sim_main.cpp',
+                         self.sim_path + '/sim_main.h'] + self.cpp_files.split()
         if self.elfmem:
-            sys_command(f"ln -f -s {self.azurite_root}/elfio/elfio obj_dir/elfio")
-            sys_command(f"ln -f -s {self.azurite_root}/devices/elfmem/elfmem.cpp obj_dir/elfmem.cpp")
-        if self.debug:
-            sys_command(f"ln -f -s {self.azurite_root}/devices/jtagdtm/remotebitbang.c obj_dir/remotebitbang.c")
-        sys_command("ln -f -s ../sim_main.cpp obj_dir/sim_main.cpp")
-        sys_command("ln -f -s ../sim_main.h obj_dir/sim_main.h")
-        make_command = 'make ' + self.verilator_speed + ' VM_PARALLEL_BUILDS=1 -j' + self.jobs + ' -C obj_dir -f V' + self.top_module + '.mk'
-        logger.info("Making verilator binary")
-        sys_command(make_command, 500)
-        logger.info('Renaming verilator Binary')
-        shutil.copy(self.sim_path + '/obj_dir/V{0}'.format(self.top_module),
-                    self.sim_path + '/azurite_core')
+            build_sources.append(f'{self.azurite_root}/elfio/elfio')
+        if self.sparse_mem:
+            build_sources.append(self.sim_path + '/sparse_mem.vlt')
+        build_key = hash_paths(build_sources, verilator_command,
+                               self.verilator_speed, verilator_version)
+        build_cache = os.path.join(self.cache_dir, 'verilator', build_key)
+
+        if os.path.isfile(build_cache + '/azurite_core'):
+            logger.info('Reusing cached verilator build: ' + build_key)
+            shutil.copy(build_cache + '/azurite_core',
+                        self.sim_path + '/azurite_core')
+        else:
+            (ret, out, err) = sys_command(verilator_command, 500)
+            if ret != 0:
+                logger.error('Verilating the design failed')
+                raise SystemExit
+            logger.info("Linking verilator simulation sources")
+            if self.elfmem:
+                sys_command(f"ln -f -s {self.azurite_root}/elfio/elfio obj_dir/elfio")
+                sys_command(f"ln -f -s {self.azurite_root}/devices/elfmem/elfmem.cpp obj_dir/elfmem.cpp")
+            if self.debug:
+                sys_command(f"ln -f -s {self.azurite_root}/devices/jtagdtm/remotebitbang.c obj_dir/remotebitbang.c")
+            sys_command("ln -f -s ../sim_main.cpp obj_dir/sim_main.cpp")
+            sys_command("ln -f -s ../sim_main.h obj_dir/sim_main.h")
+            make_command = 'make ' + self.verilator_speed + ' VM_PARALLEL_BUILDS=1 -j' + self.jobs + ' -C obj_dir -f V' + self.top_module + '.mk'
+            # obj_dir is kept across runs, the binary of a previous build must
+            # not be taken for the result of this one
+            binary = self.sim_path + '/obj_dir/V{0}'.format(self.top_module)
+            if os.path.exists(binary):
+                os.remove(binary)
+            logger.info("Making verilator binary")
+            (ret, out, err) = sys_command(make_command, 500)
+            if ret != 0 or not os.path.isfile(binary):
+                logger.error('Building the verilator binary failed')
+                raise SystemExit
+            logger.info('Renaming verilator Binary')
+            shutil.copy(binary, self.sim_path + '/azurite_core')
+            logger.info('Caching verilator build: ' + build_key)
+            os.makedirs(build_cache, exist_ok=True)
+            shutil.copy(self.sim_path + '/azurite_core',
+                        build_cache + '/azurite_core.tmp')
+            os.replace(build_cache + '/azurite_core.tmp',
+                       build_cache + '/azurite_core')
 
         logger.info('Creating boot-files')
         sys_command('make -C {0} XLEN={1}'.format(
@@ -194,7 +503,21 @@ class azurite_verilator_plugin(object):
             self.name))
         make.makeCommand = 'make -j1'
         self.make_file = os.path.join(self.work_dir, 'Makefile.' + self.name)
+        self.cmd_file = os.path.join(self.work_dir,
+                                     'commands.' + self.name + '.json')
+        self.key_file = os.path.join(self.work_dir,
+                                     'tests.' + self.name + '.list')
         self.test_names = []
+        test_commands = {}
+        if self.result_cache:
+            # Identify the simulator and the boot image once, the ELF and the
+            # command line are part of the key of every test
+            sim_key = hash_paths([self.sim_path + '/azurite_core',
+                                  self.sim_path + '/boot.mem'])
+            result_cache_cmd = 'python3 {0} run --cache {1} '.format(
+                self.result_cache_script, self.result_cache_dir)
+            result_cache_cmd += '--salt {0} '.format(sim_key)
+            result_cache_cmd += '--input dut.elf --output dut.dump'
 
         for test, attr in self.test_list.items():
             logger.debug('Creating Make Target for ' + str(test))
@@ -210,7 +533,12 @@ class azurite_verilator_plugin(object):
             skip_lines = attr['ignore_lines'] if 'ignore_lines' in attr else 4
 
             ch_cmd = 'cd {0} && '.format(work_dir)
-            compile_cmd = '{0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
+            compile_script = self.compile_script
+            if self.elf_cache and \
+                    attr.get('generator') in self.elf_cache_generators:
+                compile_script = self.elf_cache_script
+            compile_cmd = compile_script + \
+                    ' {0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
                     cc, cc_args, arch, abi, link_args, link_file, asm_file)
             for x in attr['extra_compile']:
                 compile_cmd += ' ' + x
@@ -218,17 +546,42 @@ class azurite_verilator_plugin(object):
                 compile_cmd += ' -I ' + str(x)
             compile_cmd += ' '.join(map(' -D{0}'.format,
                                         attr['compile_macros']))
-            compile_cmd += ' -o dut.elf && '
             sim_setup = 'ln -f -s ' + self.sim_path + '/azurite_core . && '
             sim_setup += 'ln -f -s ' + self.sim_path + '/boot.mem . && '
             post_process_cmd = f'head -n -{skip_lines} rtl.dump > dut.dump && rm -f rtl.dump'
-            target_cmd = ch_cmd + compile_cmd + self.objdump_cmd +\
-                    self.elf2hex_cmd + sim_setup + self.sim_cmd + ' ' + \
-                    self.sim_args + ' && '+ post_process_cmd + \
-                    ' && ' + self.clean_up
+            clean_up = self.clean_up
+            if attr.get('self_checking', False):
+                clean_up = self.self_check_cmd + ' && ' + clean_up
+            # Stages of the test, each run from the work_dir of the test
+            stages = [['compile', compile_cmd]]
+            if self.objdump_cmd:
+                stages.append(['objdump', self.objdump_cmd])
+            if self.elf2hex_cmd:
+                stages.append(['elf2hex', self.elf2hex_cmd])
+            if self.result_cache:
+                cached_cmd = result_cache_cmd
+                if attr.get('self_checking', False):
+                    cached_cmd += ' --output signature'
+                cached_cmd += " -- sh -c '{0} {1} && {2}'".format(
+                    self.sim_cmd, self.sim_args, post_process_cmd)
+                stages.append(['simulate', sim_setup + cached_cmd])
+                stages.append(['post_process', clean_up])
+            else:
+                stages.append(['simulate', sim_setup + self.sim_cmd + ' ' +
+                               self.sim_args])
+                stages.append(['post_process',
+                               post_process_cmd + ' && ' + clean_up])
+            target_cmd = ch_cmd + ' && '.join(cmd for stage, cmd in stages)
             make.add_target(target_cmd, test)
+            test_commands[test] = {'work_dir': work_dir, 'stages': stages}
             self.test_names.append(test)
 
+        with open(self.cmd_file, 'w') as cmd_file:
+            json.dump(test_commands, cmd_file)
+        # Manifest of the tests to run, one name per line
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
     @dut_hookimpl
     def run(self, module_dir):
         logger.info('Run Hook')
@@ -236,9 +589,21 @@ class azurite_verilator_plugin(object):
         pytest_file = module_dir + '/azurite_verilator_plugin/gen_framework.py'
         logger.debug('Pytest file: {0}'.format(pytest_file))
 
+        # Dispatch the tests with the longest expected runtime first
+        self.test_names = scheduling.order_tests(self.test_names,
+                                                 self.test_list,
+                                                 self.history_file)
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
         report_file_name = '{0}/{1}_{2}'.format(
             self.json_dir, self.name,
             datetime.datetime.now().strftime("%Y%m%d-%H%M"))
+        priority = []
+        if self.fast_feedback:
+            priority = scheduling.priority_tests(
+                self.test_names, self.json_dir, self.name,
+                os.path.join(self.work_dir, 'failed_list.yaml'), self.smoke)
 
         # TODO Regression list currently removed, check back later
         # TODO The logger doesn't exactly work like in the pytest module
@@ -249,13 +614,22 @@ class azurite_verilator_plugin(object):
             '--html={0}.html'.format(self.work_dir + '/reports/' + self.name),
             '--report-log={0}.json'.format(report_file_name),
             '--work_dir={0}'.format(self.work_dir),
-            '--make_file={0}'.format(self.make_file),
-            '--key_list={0}'.format(self.test_names),
+            '--cmd_file={0}'.format(self.cmd_file),
+            '--key_file={0}'.format(self.key_file),
             '--log-cli-level=DEBUG',
             '-o log_cli=true',]
         if self.stop_on_failure:
             pytest_args.append('-x')
-        pytest_state = pytest.main(pytest_args)
+        merger = None
+        if self.coverage and self.stream_coverage and \
+                shutil.which('verilator_coverage') is not None:
+            self.stream_cov_file = self.work_dir + 'stream_coverage.dat'
+            if os.path.exists(self.stream_cov_file):
+                os.remove(self.stream_cov_file)
+            merger = CoverageMerger(self.fold_coverage)
+        pytest_state = scheduling.run_priority_first(
+            pytest_args, report_file_name, self.key_file, self.test_names,
+            priority, [merger] if merger else None)
         if pytest_state == (pytest.ExitCode.INTERRUPTED or
                             pytest.ExitCode.TESTS_FAILED):
             logger.error(
@@ -263,8 +637,15 @@ class azurite_verilator_plugin(object):
 
         if self.coverage:
             final_cov_file = self.work_dir + '/final_coverage.dat'
-            coverage_cmd = 'verilator_coverage -write {0}'.format(
-                final_cov_file)
+            cov_files = []
+            merged = set()
+            if merger is not None:
+                merged = merger.finish()
+                logger.info(
+                    'Coverage of {0} tests merged during the run'.format(
+                        len(merged)))
+                if merged:
+                    cov_files.append(self.stream_cov_file)
             logger.info('Initiating Merging of coverage files')
             if shutil.which('verilator_coverage') is None:
                 logger.error('verilator_coverage missing from $PATH')
@@ -275,9 +656,14 @@ class azurite_verilator_plugin(object):
                     logger.error(\
                             'Coverage enabled but coverage file for test: '+\
                             test + ' is missing')
-                else:
-                    coverage_cmd += ' ' + test_wd + '/coverage.dat'
-            sys_command(coverage_cmd)
+                elif test not in merged:
+                    cov_files.append(test_wd + '/coverage.dat')
+            if merged and len(cov_files) == 1:
+                os.replace(self.stream_cov_file, final_cov_file)
+            else:
+                merge_coverage(cov_files, final_cov_file, int(self.jobs))
+                if merged:
+                    os.remove(self.stream_cov_file)
             logger.info('Final coverage file is at: {0}'.format(final_cov_file))
             logger.info('Annotating source files with final_coverage.dat')
             sys_command(\
@@ -286,8 +672,53 @@ class azurite_verilator_plugin(object):
             logger.info(
                 'Annotated source available at: {0}/annotated_src'.format(
                     self.work_dir))
+        if self.elf_cache:
+            logger.debug('Limiting ELF cache to {0} MB'.format(
+                self.elf_cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'result_cache.py'), self.elf_cache_dir,
+                self.elf_cache_size))
+        if self.result_cache:
+            logger.debug('Limiting result cache to {0} MB'.format(
+                self.cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                self.result_cache_script, self.result_cache_dir,
+                self.cache_size))
+        scheduling.record_durations(report_file_name + '.json',
+                                    self.history_file, self.test_list)
         return report_file_name
 
+    def fold_coverage(self, test):
+        '''
+            Merge the coverage file of a test into the running aggregate of
+            the run
+
+            :param test: name of the test
+
+            :type test: str
+
+            :return: True if the coverage of the test was merged
+
+            :rtype: bool
+        '''
+        if test not in self.test_list:
+            return False
+        cov_file = self.test_list[test]['work_dir'] + '/coverage.dat'
+        if not os.path.isfile(cov_file):
+            return False
+        (root, ext) = os.path.splitext(self.stream_cov_file)
+        if os.path.isfile(self.stream_cov_file):
+            (ret, out, err) = sys_command(
+                'verilator_coverage -write {0}_tmp{1} {0}{1} {2}'.format(
+                    root, ext, cov_file))
+            if ret != 0:
+                return False
+        else:
+            shutil.copyfile(cov_file, root + '_tmp' + ext)
+        os.replace(root + '_tmp' + ext, self.stream_cov_file)
+        return True
+
     @dut_hookimpl
     def post_run(self, test_dict, config):
 
@@ -319,6 +750,10 @@ class azurite_verilator_plugin(object):
                 if test_dict[test]['result'] == 'Passed':
                     logger.debug("Removing extra files for Test: " + str(test))
                     work_dir = test_dict[test]['work_dir']
+                    # The coverage of the test was merged during the run
+                    if self.coverage and self.stream_coverage and \
+                            os.path.isfile(work_dir + '/coverage.dat'):
+                        os.remove(work_dir + '/coverage.dat')
                     try:
                         os.remove(work_dir + '/app_log')
                         os.remove(work_dir + '/code.mem')
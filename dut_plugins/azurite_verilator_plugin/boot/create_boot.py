@@ -1,49 +1,115 @@
-import shlex
+# See LICENSE for details
+'''
+    Create the boot ROM image (boot.hex) from the device tree source.
+
+    Usage: python3 create_boot.py <xlen> <dts> [--split]
+
+    The image holds the reset vector code followed by the device tree blob,
+    one little-endian word of xlen bits per line, padded with zeros to the
+    depth of the boot ROM. With --split the upper and lower 32 bits of every
+    line are written to boot.MSB and boot.LSB as well.
+
+    The key of the last image (contents of the dts, xlen and the options) is
+    kept in boot.key, the image is only created again when the key changes.
+'''
+
+import argparse
+import hashlib
+import os
 import subprocess
 import sys
 
-xlen = int(sys.argv[1])
-size = int(xlen/4)
-width = int(xlen/8)
-
-if xlen == 32:
-    count = 8
-    prefix = '''00000297
-02028593
-f1402573
-0182a283
-00028067
-00000000
-80000000
-00000000
-'''
-elif xlen == 64:
-    count = 4
-    prefix = '''0202859300000297
-0182b283f1402573
-0000000000028067
-0000000080000000
-'''
-else:
-    count = 2
-    prefix = '''0182b283f14025730202859300000297
-00000000800000000000000000028067
-'''
-subprocess.run(shlex.split("dtc -O dtb -o azurite.dtb -b 0 azurite.dts"))
-subprocess.run(shlex.split(f"xxd -e -c {width} azurite.dtb config.azurite"))
+depth = 8192
+key_name = 'boot.key'
+
+# Reset vector code, jumping to 0x80000000 with the hart id in a0 and the
+# address of the device tree in a1
+prefix = {
+    32: ['00000297', '02028593', 'f1402573', '0182a283', '00028067',
+         '00000000', '80000000', '00000000'],
+    64: ['0202859300000297', '0182b283f1402573', '0000000000028067',
+         '0000000080000000'],
+    128: ['0182b283f14025730202859300000297',
+          '00000000800000000000000000028067']
+}
+
+
+def boot_words(dtb, xlen):
+    '''
+        Create the lines of the boot image
+
+        :param dtb: device tree blob
+
+        :param xlen: width of a line in bits
+
+        :type dtb: bytes
+
+        :type xlen: int
+
+        :return: hex words of the image
+
+        :rtype: list
+    '''
+    width = xlen // 8
+    dtb += bytes(-len(dtb) % width)
+    lines = list(prefix[xlen])
+    for pos in range(0, len(dtb), width):
+        lines.append(dtb[pos:pos + width][::-1].hex())
+    if len(lines) > depth:
+        raise ValueError('device tree does not fit in the boot ROM')
+    lines += ['0' * (2 * width)] * (depth - len(lines))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the boot image')
+    parser.add_argument('xlen', type=int, choices=sorted(prefix))
+    parser.add_argument('dts', help='device tree source')
+    parser.add_argument('--split', action='store_true',
+                        help='write boot.MSB and boot.LSB as well')
+    args = parser.parse_args()
+
+    outputs = ['boot.hex']
+    if args.split:
+        outputs += ['boot.MSB', 'boot.LSB']
+
+    with open(args.dts, 'rb') as f:
+        dts = f.read()
+    hasher = hashlib.sha256(dts)
+    hasher.update('\0{0}\0{1}'.format(args.xlen, args.split).encode())
+    key = hasher.hexdigest()
+    if all(os.path.isfile(name) for name in outputs) and \
+            os.path.isfile(key_name):
+        with open(key_name, 'r') as f:
+            if f.read().strip() == key:
+                return 0
 
-boothex = open('boot.hex', 'w')
-boothex.write(prefix)
-with open('config.azurite', 'r') as myfile:
-    for line in myfile:
-        count += 1
-        cols = line.split()[1:-1]
-        cols.reverse()
-        val = f"{int(''.join(cols),16):0{size}x}"
-        boothex.write(f'{val}\n')
+    dtc = subprocess.run(['dtc', '-O', 'dtb', '-b', '0', args.dts],
+                         stdout=subprocess.PIPE)
+    if dtc.returncode != 0:
+        sys.stderr.write('dtc failed on {0}\n'.format(args.dts))
+        return 1
+    try:
+        lines = boot_words(dtc.stdout, args.xlen)
+    except ValueError as e:
+        sys.stderr.write(str(e) + '\n')
+        return 1
 
-for i in range(8192-count):
-    boothex.write(''.join(['0']*size)+'\n')
-boothex.close()
+    images = {'boot.hex': lines}
+    if args.split:
+        images['boot.MSB'] = [line[:8] for line in lines]
+        images['boot.LSB'] = [line[8:16] or line[:8] for line in lines]
+    # The key is removed first so that an interrupted run is not reused
+    if os.path.exists(key_name):
+        os.remove(key_name)
+    for name, image in images.items():
+        with open(name + '.tmp', 'w') as f:
+            f.write('\n'.join(image) + '\n')
+        os.replace(name + '.tmp', name)
+    with open(key_name, 'w') as f:
+        f.write(key + '\n')
+    return 0
 
 
+if __name__ == '__main__':
+    sys.exit(main())
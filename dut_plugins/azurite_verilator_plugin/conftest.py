@@ -9,9 +9,9 @@ def pytest_html_report_title(report):
 
 
 def pytest_addoption(parser):
-    parser.addoption("--make_file", action="store")
+    parser.addoption("--cmd_file", action="store")
     parser.addoption("--work_dir", action="store")
-    parser.addoption("--key_list", action="store")
+    parser.addoption("--key_file", action="store")
 
 
 @pytest.mark.optionalhook
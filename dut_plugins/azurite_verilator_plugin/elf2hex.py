@@ -0,0 +1,142 @@
+# See LICENSE for details
+'''
+    Convert an ELF into a sparse memory image for $readmemh.
+
+    Usage: python3 elf2hex.py <width> <depth> <elf> <base> > code.mem
+
+    The arguments match those of elf2hex: the memory has <depth> words of
+    <width> bytes starting at address <base>. Instead of printing every word
+    of the memory, only the words holding non-zero data of the loadable
+    segments are printed, each run preceded by an "@<word index>" address
+    directive. The memory words which are not listed must therefore be zero
+    initialised by the simulator (+sparsemem=<memory> for the verilator
+    testbench).
+'''
+
+import struct
+import sys
+
+# Zero words shorter than this are printed instead of starting a new run
+min_gap = 16
+
+
+def load_segments(path):
+    '''
+        Read the PT_LOAD segments of an ELF
+
+        :param path: path of the ELF
+
+        :type path: str
+
+        :return: list of (physical address, data) tuples, the data being
+            zero extended to the memory size of the segment
+
+        :rtype: list
+    '''
+    with open(path, 'rb') as f:
+        elf = f.read()
+    if elf[:4] != b'\x7fELF':
+        raise ValueError('{0} is not an ELF file'.format(path))
+    endian = '<' if elf[5] == 1 else '>'
+    if elf[4] == 2:
+        (phoff, ) = struct.unpack_from(endian + 'Q', elf, 0x20)
+        phentsize, phnum = struct.unpack_from(endian + 'HH', elf, 0x36)
+        phdr = endian + 'IIQQQQQQ'
+    else:
+        (phoff, ) = struct.unpack_from(endian + 'I', elf, 0x1c)
+        phentsize, phnum = struct.unpack_from(endian + 'HH', elf, 0x2a)
+        phdr = endian + 'IIIIIIII'
+
+    segments = []
+    for index in range(phnum):
+        fields = struct.unpack_from(phdr, elf, phoff + index * phentsize)
+        if elf[4] == 2:
+            p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, \
+                p_memsz, p_align = fields
+        else:
+            p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, \
+                p_flags, p_align = fields
+        if p_type != 1 or p_memsz == 0:
+            continue
+        data = elf[p_offset:p_offset + p_filesz]
+        data += bytes(p_memsz - len(data))
+        segments.append((p_paddr, data))
+    return segments
+
+
+def sparse_image(segments, width, depth, base):
+    '''
+        Create the lines of the sparse memory image
+
+        :param segments: list of (address, data) tuples
+
+        :param width: bytes per memory word
+
+        :param depth: number of memory words
+
+        :param base: address of the first memory word
+
+        :return: lines of the image
+
+        :rtype: list
+    '''
+    # Gather the words of every segment, later segments overriding earlier
+    # ones. Only the partial words at the edges of a segment are filled
+    # byte by byte.
+    words = {}
+
+    def set_bytes(offset, data):
+        for pos, value in enumerate(data):
+            index = (offset + pos) // width
+            if 0 <= index < depth:
+                word = words.setdefault(index, bytearray(width))
+                word[(offset + pos) % width] = value
+
+    for address, data in segments:
+        offset = address - base
+        end = offset + len(data)
+        first = min(end, -(-offset // width) * width)
+        last = max(first, end - end % width)
+        set_bytes(offset, data[:first - offset])
+        for pos in range(first, last, width):
+            index = pos // width
+            if 0 <= index < depth:
+                words[index] = bytearray(data[pos - offset:pos - offset +
+                                              width])
+        set_bytes(last, data[last - offset:])
+
+    lines = []
+    previous = None
+    for index in sorted(words):
+        if not any(words[index]):
+            continue
+        if previous is None or index - previous > min_gap:
+            lines.append('@{0:x}'.format(index))
+        else:
+            lines += ['0' * (2 * width)] * (index - previous - 1)
+        # Words are printed most significant byte first
+        lines.append(words[index][::-1].hex())
+        previous = index
+    return lines
+
+
+def main():
+    if len(sys.argv) != 5:
+        sys.stderr.write(
+            'Usage: python3 elf2hex.py <width> <depth> <elf> <base>\n')
+        return 1
+    width = int(sys.argv[1])
+    depth = int(sys.argv[2])
+    base = int(sys.argv[4], 0)
+    try:
+        segments = load_segments(sys.argv[3])
+    except (OSError, ValueError, struct.error) as e:
+        sys.stderr.write(str(e) + '\n')
+        return 1
+    lines = sparse_image(segments, width, depth, base)
+    sys.stdout.write('\n'.join(lines) + '\n' if lines else '')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
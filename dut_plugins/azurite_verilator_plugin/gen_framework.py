@@ -11,30 +11,32 @@ import datetime
 import pytest
 import filecmp
 import glob
+import json
+import shlex
 
 from river_core.log import logger
 from river_core.utils import *
 
 
-def compile_cmd_list(make_file, work_dir, key_list):
+def compile_cmd_list(cmd_file, work_dir, key_file):
 
     run_commands = []
 
-    # Hmm here the key_list becomes a string need to do some magic to get into proper list
-    # RE Magic here
-    replacements = {"[": "", "]": "", "'": "", " ": ""}
-    replacements = dict((re.escape(k), v) for k, v in replacements.items())
-    pattern = re.compile("|".join(replacements.keys()))
-    str_key_list = pattern.sub(lambda m: replacements[re.escape(m.group(0))],
-                               key_list)
-    key_list = str_key_list.split(",")
+    # The stages of every test are written by the build hook of the plugin
+    with open(cmd_file, 'r') as f:
+        test_commands = json.load(f)
 
-    for file_name in key_list:
-        logger.debug(
-            "Creating Makefile command for {0} to build ASM files".format(
-                file_name))
-        run_commands.append('make -f {0} {1}'.format(
-            make_file, file_name))
+    # The tests to run are listed one per line in key_file
+    with open(key_file, 'r') as keys:
+        for line in keys:
+            file_name = line.strip()
+            if not file_name:
+                continue
+            logger.debug(
+                "Collecting commands for {0}".format(file_name))
+            run_commands.append([file_name,
+                                 test_commands[file_name]['work_dir'],
+                                 test_commands[file_name]['stages']])
     return run_commands
 
 
@@ -48,19 +50,25 @@ def pytest_generate_tests(metafunc):
         logger.debug('Generating commands from pytest_framework')
         test_list = compile_cmd_list(
             # metafunc.config.getoption("output_dir"),
-            metafunc.config.getoption("make_file"),
+            metafunc.config.getoption("cmd_file"),
             metafunc.config.getoption("work_dir"),
-            metafunc.config.getoption("key_list"))
-        metafunc.parametrize('test_input', test_list, ids=idfnc, indirect=True)
+            metafunc.config.getoption("key_file"))
+        metafunc.parametrize('test_input', test_list,
+                             ids=[idfnc(test[0]) for test in test_list],
+                             indirect=True)
 
 
 @pytest.fixture
 def test_input(request):
-    # compile tests
+    # run the stages of the test in order, stopping at the first failure
     logger.debug('Generating commands from test_input fixture')
-    program = request.param
-    stage = program.split()[-1]
-    (ret, out, err) = sys_command(program, 100)
+    test, work_dir, stages = request.param
+    for stage, command in stages:
+        program = shlex.join(['sh', '-c', 'cd {0} && {1}'.format(work_dir,
+                                                                  command)])
+        (ret, out, err) = sys_command(program, 100)
+        if ret != 0:
+            break
     return ret, err, stage
 
 def test_eval(test_input):
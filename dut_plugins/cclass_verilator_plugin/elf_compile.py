@@ -0,0 +1,191 @@
+# See LICENSE for details
+'''
+    Compile a test into a shared ELF which is reused by every plugin running
+    the test in the same work directory.
+
+    Usage: python3 elf_compile.py --link <name.elf> [--cache <dir>]
+                -- <compile command>
+
+    The compile command is given without the -o option. The ELF is written to
+    test.elf and a key computed over the command line, the compiler binary,
+    the input files and the include directories is stored next to it in
+    test.elf.key. When the key of a later invocation matches, the compiler is
+    not run again. The requested name is then linked to test.elf.
+
+    With --cache, ELFs are also kept in a persistent cache shared across
+    regressions (see result_cache.py). Its key does not depend on the
+    location of the test: it is computed over the compiler version, the
+    options, and the contents of the input files and of every file the
+    sources include, as listed by the compiler's -M output.
+'''
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+
+import result_cache
+
+elf_name = 'test.elf'
+key_name = 'test.elf.key'
+
+
+def hash_file(hasher, path):
+    '''
+        Feed the contents of a file into the hasher
+
+        :param hasher: hashlib object to update
+
+        :param path: file to read
+
+        :type path: str
+    '''
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+
+
+def compile_key(command):
+    '''
+        Compute the key identifying the output of a compile command
+
+        :param command: compile command as a list of arguments
+
+        :type command: list
+
+        :return: hex digest of the key
+
+        :rtype: str
+    '''
+    hasher = hashlib.sha256()
+    for arg in command:
+        hasher.update(arg.encode() + b'\0')
+
+    # Identify the compiler binary itself, so that a toolchain update is
+    # picked up without hashing the whole toolchain.
+    compiler = shutil.which(command[0])
+    if compiler is not None:
+        stat = os.stat(compiler)
+        hasher.update('{0}:{1}:{2}\0'.format(os.path.realpath(compiler),
+                                             stat.st_size,
+                                             stat.st_mtime_ns).encode())
+
+    include_dirs = []
+    for index, arg in enumerate(command[1:], 1):
+        if arg == '-I' and index + 1 < len(command):
+            include_dirs.append(command[index + 1])
+        elif arg.startswith('-I') and len(arg) > 2:
+            include_dirs.append(arg[2:])
+        elif os.path.isfile(arg):
+            hasher.update(arg.encode() + b'\0')
+            hash_file(hasher, arg)
+
+    for include in include_dirs:
+        for root, dirs, files in os.walk(include):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if os.path.isfile(path):
+                    hasher.update(path.encode() + b'\0')
+                    hash_file(hasher, path)
+    return hasher.hexdigest()
+
+
+def cache_key(command):
+    '''
+        Compute the key of a compile command in the persistent cache
+
+        :param command: compile command as a list of arguments
+
+        :type command: list
+
+        :return: hex digest of the key, None if the compiler could not list
+            the included files
+
+        :rtype: str
+    '''
+    try:
+        version = subprocess.run([command[0], '--version'],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL)
+        deps = subprocess.run(command + ['-M'],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if version.returncode != 0 or deps.returncode != 0:
+        return None
+
+    hasher = hashlib.sha256(version.stdout)
+    include_arg = False
+    for arg in command[1:]:
+        # Include directories only matter through the files found there,
+        # which are part of the dependencies
+        if include_arg:
+            include_arg = False
+        elif arg == '-I':
+            include_arg = True
+        elif arg.startswith('-I'):
+            continue
+        elif os.path.isfile(arg):
+            hasher.update(os.path.basename(arg).encode() + b'\0')
+            hash_file(hasher, arg)
+        else:
+            hasher.update(arg.encode() + b'\0')
+
+    files = deps.stdout.decode(errors='replace').replace('\\\n', ' ').split()
+    for path in sorted(set(x for x in files if not x.endswith(':'))):
+        if os.path.isfile(path):
+            hasher.update(b'\0dep\0' + os.path.basename(path).encode() +
+                          b'\0')
+            hash_file(hasher, path)
+    return hasher.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile a shared test ELF')
+    parser.add_argument('--link', required=True,
+                        help='name under which the ELF is made available')
+    parser.add_argument('--cache', help='persistent cache directory')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+                        help='compile command without the -o option')
+    args = parser.parse_args()
+
+    command = args.command
+    if command and command[0] == '--':
+        command = command[1:]
+    if not command:
+        parser.error('no compile command given')
+
+    key = compile_key(command)
+    cached = False
+    if os.path.isfile(elf_name) and os.path.isfile(key_name):
+        with open(key_name, 'r') as f:
+            cached = f.read().strip() == key
+
+    if not cached:
+        if os.path.exists(key_name):
+            os.remove(key_name)
+        persistent_key = cache_key(command) if args.cache else None
+        if persistent_key is None or result_cache.restore(
+                args.cache, persistent_key, [elf_name]) is None:
+            ret = subprocess.call(command + ['-o', elf_name + '.tmp'])
+            if ret != 0:
+                return ret
+            os.replace(elf_name + '.tmp', elf_name)
+            if persistent_key is not None:
+                result_cache.store(args.cache, persistent_key, [elf_name], 0)
+        with open(key_name, 'w') as f:
+            f.write(key + '\n')
+
+    if args.link != elf_name:
+        if os.path.lexists(args.link):
+            os.remove(args.link)
+        os.symlink(elf_name, args.link)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+# See LICENSE for details
+'''
+    Persistent cache for the outputs of deterministic commands.
+
+    Usage:
+
+        python3 result_cache.py run --cache <dir> [--salt <salt>]
+            --input <file> [--input <file> ...]
+            --output <file> [--output <file> ...] -- <command>
+
+        python3 result_cache.py evict --cache <dir> --max-size <MB>
+
+    The key of a run is computed over the salt, the command line and the
+    contents of the input files. On a hit the outputs and the exit status
+    stored for the key are restored in the current directory and the command
+    is not executed. On a miss the command is executed and, when all outputs
+    were produced, they are stored in the cache together with its exit
+    status.
+
+    Entries are directories whose modification time is refreshed on every
+    hit. Eviction removes the least recently used entries until the cache
+    fits in the given size, so that the cache can live on a shared disk.
+'''
+
+import argparse
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+status_name = '.status'
+
+
+def entry_path(cache_dir, key):
+    '''
+        Directory holding the entry for a key
+
+        :param cache_dir: root directory of the cache
+
+        :param key: hex digest of the entry
+
+        :return: path of the entry
+    '''
+    return os.path.join(cache_dir, key[:2], key)
+
+
+def compute_key(command, inputs, salt=''):
+    '''
+        Compute the key of a command run
+
+        :param command: command as a list of arguments
+
+        :param inputs: files whose contents the outputs depend on
+
+        :param salt: additional string identifying the tools used
+
+        :return: hex digest of the key
+
+        :rtype: str
+    '''
+    hasher = hashlib.sha256()
+    hasher.update(salt.encode() + b'\0')
+    for arg in command:
+        hasher.update(arg.encode() + b'\0')
+    for path in inputs:
+        hasher.update(b'\0input\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def restore(cache_dir, key, outputs):
+    '''
+        Restore the outputs of a cached run into the current directory
+
+        :param cache_dir: root directory of the cache
+
+        :param key: key of the run
+
+        :param outputs: names of the output files
+
+        :return: stored exit status, or None if the entry is not available
+
+        :rtype: int
+    '''
+    entry = entry_path(cache_dir, key)
+    try:
+        with open(os.path.join(entry, status_name), 'r') as f:
+            status = int(f.read().strip())
+        for name in outputs:
+            shutil.copyfile(os.path.join(entry, os.path.basename(name)),
+                            name + '.tmp')
+        for name in outputs:
+            os.replace(name + '.tmp', name)
+        os.utime(entry)
+    except (OSError, ValueError):
+        # The entry is missing, incomplete or was evicted meanwhile
+        for name in outputs:
+            if os.path.exists(name + '.tmp'):
+                os.remove(name + '.tmp')
+        return None
+    return status
+
+
+def store(cache_dir, key, outputs, status):
+    '''
+        Store the outputs of a run in the cache
+
+        :param cache_dir: root directory of the cache
+
+        :param key: key of the run
+
+        :param outputs: names of the output files in the current directory
+
+        :param status: exit status of the run
+    '''
+    entry = entry_path(cache_dir, key)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=os.path.dirname(entry),
+                               prefix='.' + key[:8])
+    try:
+        for name in outputs:
+            shutil.copyfile(name,
+                            os.path.join(staging, os.path.basename(name)))
+        with open(os.path.join(staging, status_name), 'w') as f:
+            f.write(str(status) + '\n')
+        # Another worker may have stored the same entry meanwhile, in which
+        # case the rename fails and its entry is kept.
+        os.rename(staging, entry)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def run_cached(cache_dir, command, inputs, outputs, salt=''):
+    '''
+        Run a command unless its outputs are available in the cache
+
+        :param cache_dir: root directory of the cache
+
+        :param command: command as a list of arguments
+
+        :param inputs: files whose contents the outputs depend on
+
+        :param outputs: files produced by the command
+
+        :param salt: additional string identifying the tools used
+
+        :return: exit status of the command
+
+        :rtype: int
+    '''
+    key = compute_key(command, inputs, salt)
+    status = restore(cache_dir, key, outputs)
+    if status is not None:
+        return status
+    status = subprocess.call(command)
+    # Runs which were killed or did not produce every output are not stored
+    if status >= 0 and all(os.path.isfile(name) for name in outputs):
+        store(cache_dir, key, outputs, status)
+    return status
+
+
+def evict(cache_dir, max_size):
+    '''
+        Remove the least recently used entries until the cache fits
+
+        :param cache_dir: root directory of the cache
+
+        :param max_size: maximum size of the cache in bytes
+
+        :return: number of entries removed
+
+        :rtype: int
+    '''
+    entries = []
+    total = 0
+    if not os.path.isdir(cache_dir):
+        return 0
+    for bucket in os.listdir(cache_dir):
+        bucket = os.path.join(cache_dir, bucket)
+        if not os.path.isdir(bucket):
+            continue
+        for name in os.listdir(bucket):
+            if name.startswith('.'):
+                continue
+            entry = os.path.join(bucket, name)
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry, f))
+                    for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except OSError:
+                continue
+            total += size
+
+    removed = 0
+    for mtime, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cache command outputs')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run a command')
+    run_parser.add_argument('--cache', required=True,
+                            help='cache directory')
+    run_parser.add_argument('--salt', default='',
+                            help='string identifying the tools used')
+    run_parser.add_argument('--input', action='append', default=[],
+                            help='input file of the command')
+    run_parser.add_argument('--output', action='append', default=[],
+                            help='output file of the command')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER,
+                            help='command to run')
+
+    evict_parser = subparsers.add_parser('evict', help='limit cache size')
+    evict_parser.add_argument('--cache', required=True,
+                              help='cache directory')
+    evict_parser.add_argument('--max-size', type=int, required=True,
+                              help='maximum size of the cache in MB')
+    args = parser.parse_args()
+
+    if args.action == 'evict':
+        removed = evict(args.cache, args.max_size * 1024 * 1024)
+        print('Evicted {0} entries from {1}'.format(removed, args.cache))
+        return 0
+
+    command = args.command
+    if command and command[0] == '--':
+        command = command[1:]
+    if not command:
+        run_parser.error('no command given')
+    return run_cached(args.cache, command, args.input, args.output,
+                      args.salt)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,9 @@
 #include <verilated.h>
 
 #include <verilated_vcd_c.h>
+#include <verilated_syms.h>
+
+#include <cstring>
 
 #include "sim_main.h"
 
@@ -12,6 +15,31 @@ double sc_time_stamp () {    // Called by $time in Verilog
     return main_time;
 }
 
+// Sparse memory images (+sparsemem=<variable>) only hold the populated words
+// of the memory. The memory, the only public variable of that name (see
+// sparse_mem.vlt), is zeroed after the model is constructed and before its
+// initial blocks load the image. The rest of the model keeps the randomized
+// reset.
+static void clear_sparse_mem (const char* name) {
+    int cleared = 0;
+    const VerilatedScopeNameMap* scopes =
+        Verilated::threadContextp()->scopeNameMap();
+    if (scopes) {
+        for (const auto& scope : *scopes) {
+            VerilatedVarNameMap* vars = scope.second->varsp();
+            if (!vars) continue;
+            for (auto& var : *vars) {
+                if (strcmp(var.first, name)) continue;
+                memset(var.second.datap(), 0, var.second.totalSize());
+                cleared++;
+            }
+        }
+    }
+    if (!cleared) {
+        fprintf(stderr, "No public memory %s to clear for +sparsemem\n", name);
+    }
+}
+
 int main (int argc, char **argv, char **env) {
     
     // Prevent unused variable warnings
@@ -28,6 +56,11 @@ int main (int argc, char **argv, char **env) {
 
     TOPMODULE* top = new TOPMODULE;    // create instance of model
 
+    const char* sparse = Verilated::commandArgsPlusMatch("sparsemem=");
+    if (sparse && 0==strncmp(sparse, "+sparsemem=", 11)) {
+        clear_sparse_mem(sparse + 11);
+    }
+
 #if VM_TRACE
     // If verilator was invoked with --trace argument,
     // and if at run time passed the +trace argument, turn on tracing
@@ -3,18 +3,82 @@
 import os
 import sys
 import pluggy
+import importlib.util
 import shutil
 import random
 import re
 import datetime
+import json
 import pytest
 import glob
+import queue
+import threading
+import shlex
 
 from river_core.log import logger
 from river_core.utils import *
 
 dut_hookimpl = pluggy.HookimplMarker('dut')
 
+# Test scheduling shared by the plugins, an identical copy of scheduling.py
+# is kept next to every plugin
+scheduling_spec = importlib.util.spec_from_file_location(
+    __name__ + '_scheduling',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scheduling.py'))
+scheduling = importlib.util.module_from_spec(scheduling_spec)
+scheduling_spec.loader.exec_module(scheduling)
+
+
+class CoverageMerger(object):
+    '''
+        Pytest plugin merging the coverage of every test into a running
+        aggregate as soon as the test finishes. The merges are done one at a
+        time by a background thread so that the dispatch of the tests is not
+        held up.
+
+        :param fold: function merging the coverage of a test, given its name,
+            into the aggregate and returning True when it was merged
+
+        :type fold: function
+    '''
+
+    def __init__(self, fold):
+        self.fold = fold
+        self.merged = set()
+        self.tests = queue.Queue()
+        self.thread = threading.Thread(target=self.merge_tests, daemon=True)
+        self.thread.start()
+
+    def pytest_runtest_logreport(self, report):
+        # With xdist the reports of the workers are passed on to this hook in
+        # the controlling process
+        if report.when == 'call':
+            self.tests.put(report.nodeid.rsplit('[', 1)[-1][:-1])
+
+    def merge_tests(self):
+        while True:
+            test = self.tests.get()
+            if test is None:
+                break
+            try:
+                if self.fold(test):
+                    self.merged.add(test)
+            except Exception as e:
+                logger.error('Merging coverage of {0} failed: {1}'.format(
+                    test, e))
+
+    def finish(self):
+        '''
+            Wait for the pending merges to complete
+
+            :return: names of the tests whose coverage is in the aggregate
+
+            :rtype: set
+        '''
+        self.tests.put(None)
+        self.thread.join()
+        return self.merged
+
 
 class chromite_cadence_plugin(object):
     '''
@@ -67,13 +131,67 @@ class chromite_cadence_plugin(object):
             self.xlen = 32
         self.elf = 'dut.elf'
 
-        self.elf2hex_cmd = 'elf2hex {0} 4194304 dut.elf 2147483648 > code.mem && '.format(
+        self.elf2hex_cmd = 'elf2hex {0} 4194304 dut.elf 2147483648 > code.mem'.format(
             str(int(self.xlen / 8)))
-        self.objdump_cmd = 'riscv{0}-unknown-elf-objdump -D dut.elf > dut.disass && '.format(
+        self.objdump_cmd = 'riscv{0}-unknown-elf-objdump -D dut.elf > dut.disass'.format(
             self.xlen)
         self.sim_cmd = './chromite_core'
         self.sim_args = '+rtldump > /dev/null'
-
+        # Self-checking tests report their result in the signature, which
+        # river_core checks as dut.signature instead of comparing the dumps
+        self.self_check_cmd = 'cp signature dut.signature'
+
+        # Tests are compiled once into a shared ELF in the test work_dir which
+        # is reused by the other plugins running the same test.
+        self.compile_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link dut.elf --'
+        # Persistent cache for artifacts which can be reused across runs
+        if 'cache_dir' in ini_config:
+            self.cache_dir = os.path.abspath(ini_config['cache_dir'])
+        else:
+            self.cache_dir = os.path.abspath(work_dir) + '/.cache'
+        # The ELFs of static suites, whose sources are the same in every
+        # regression, are also kept in a persistent cache bounded to
+        # elf_cache_size MB
+        if 'elf_cache' in ini_config:
+            self.elf_cache = str_2_bool(ini_config['elf_cache'])
+        else:
+            self.elf_cache = True
+        if 'elf_cache_generators' in ini_config:
+            self.elf_cache_generators = [
+                x.strip() for x in ini_config['elf_cache_generators'].split(',')
+            ]
+        else:
+            self.elf_cache_generators = ['riscv_tests', 'riscof', 'ctg']
+        if 'elf_cache_size' in ini_config:
+            self.elf_cache_size = int(ini_config['elf_cache_size'])
+        else:
+            self.elf_cache_size = 2048
+        self.elf_cache_dir = os.path.join(self.cache_dir, 'elf')
+        self.elf_cache_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link dut.elf --cache {0} --'.format(
+                self.elf_cache_dir)
+        # Run the tests which failed in the previous run and the smoke tests
+        # (comma separated fnmatch patterns of test names) ahead of the
+        # regression, in a pytest session of their own
+        if 'fast_feedback' in ini_config:
+            self.fast_feedback = str_2_bool(ini_config['fast_feedback'])
+        else:
+            self.fast_feedback = False
+        if 'smoke' in ini_config:
+            self.smoke = [
+                x.strip() for x in ini_config['smoke'].split(',') if x.strip()
+            ]
+        else:
+            self.smoke = []
+        # Merge the coverage of every test into a running aggregate while
+        # the regression runs instead of merging all of them at the end
+        if 'stream_coverage' in ini_config:
+            self.stream_coverage = str_2_bool(ini_config['stream_coverage'])
+        else:
+            self.stream_coverage = False
         self.work_dir = os.path.abspath(work_dir) + '/'
 
         self.sim_path = self.work_dir + self.name
@@ -82,6 +200,8 @@ class chromite_cadence_plugin(object):
         self.test_list = load_yaml(test_list)
 
         self.json_dir = self.work_dir + '/.json/'
+        # Runtimes of the tests in previous runs, used to schedule them
+        self.history_file = self.json_dir + 'history_' + self.name + '.json'
 
         # Check if dir exists
         if (os.path.isdir(self.json_dir)):
@@ -224,7 +344,12 @@ class chromite_cadence_plugin(object):
             self.name))
         make.makeCommand = 'make -j1'
         self.make_file = os.path.join(self.work_dir, 'Makefile.' + self.name)
+        self.cmd_file = os.path.join(self.work_dir,
+                                     'commands.' + self.name + '.json')
+        self.key_file = os.path.join(self.work_dir,
+                                     'tests.' + self.name + '.list')
         self.test_names = []
+        test_commands = {}
 
         for test, attr in self.test_list.items():
             logger.debug('Creating Make Target for ' + str(test))
@@ -239,13 +364,17 @@ class chromite_cadence_plugin(object):
             asm_file = attr['asm_file']
 
             ch_cmd = 'cd {0} && '.format(work_dir)
-            compile_cmd = '{0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
+            compile_script = self.compile_script
+            if self.elf_cache and \
+                    attr.get('generator') in self.elf_cache_generators:
+                compile_script = self.elf_cache_script
+            compile_cmd = compile_script + \
+                    ' {0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
                     cc, cc_args, arch, abi, link_args, link_file, asm_file)
             for x in attr['extra_compile']:
                 compile_cmd += ' ' + x
             compile_cmd += ' '.join(map(' -D{0}'.format,
                                         attr['compile_macros']))
-            compile_cmd += ' -o dut.elf && '
             with open(work_dir + '/imc.cmd', 'w') as f:
                 f.write('load ' + work_dir + '/cov_work/scope/' + test + '\n')
                 f.write(
@@ -263,12 +392,26 @@ class chromite_cadence_plugin(object):
             sim_setup += 'ln -f -s ' + self.sim_path + '/hdl.var . && '
             sim_setup += 'ln -f -s ' + self.sim_path + '/work . && '
             post_process_cmd = 'head -n -4 rtl.dump > dut.dump && rm -f rtl.dump'
-            target_cmd = ch_cmd + compile_cmd + self.objdump_cmd +\
-                    self.elf2hex_cmd + sim_setup + self.sim_cmd + '_' + test + ' ' + \
-                    self.sim_args +' && '+ post_process_cmd
+            if attr.get('self_checking', False):
+                post_process_cmd += ' && ' + self.self_check_cmd
+            # Stages of the test, each run from the work_dir of the test
+            stages = [['compile', compile_cmd],
+                      ['objdump', self.objdump_cmd],
+                      ['elf2hex', self.elf2hex_cmd],
+                      ['simulate', sim_setup + self.sim_cmd + '_' + test +
+                       ' ' + self.sim_args],
+                      ['post_process', post_process_cmd]]
+            target_cmd = ch_cmd + ' && '.join(cmd for stage, cmd in stages)
             make.add_target(target_cmd, test)
+            test_commands[test] = {'work_dir': work_dir, 'stages': stages}
             self.test_names.append(test)
 
+        with open(self.cmd_file, 'w') as cmd_file:
+            json.dump(test_commands, cmd_file)
+        # Manifest of the tests to run, one name per line
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
     @dut_hookimpl
     def run(self, module_dir):
         logger.info('Run Hook')
@@ -276,15 +419,27 @@ class chromite_cadence_plugin(object):
         pytest_file = module_dir + '/chromite_cadence_plugin/gen_framework.py'
         logger.debug('Pytest file: {0}'.format(pytest_file))
 
+        # Dispatch the tests with the longest expected runtime first
+        self.test_names = scheduling.order_tests(self.test_names,
+                                                 self.test_list,
+                                                 self.history_file)
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
         report_file_name = '{0}/{1}_{2}'.format(
             self.json_dir, self.name,
             datetime.datetime.now().strftime("%Y%m%d-%H%M"))
+        priority = []
+        if self.fast_feedback:
+            priority = scheduling.priority_tests(
+                self.test_names, self.json_dir, self.name,
+                os.path.join(self.work_dir, 'failed_list.yaml'), self.smoke)
 
         # TODO Regression list currently removed, check back later
         # TODO The logger doesn't exactly work like in the pytest module
         # pytest.main([pytest_file, '-n={0}'.format(self.jobs), '-k={0}'.format(self.filter), '-v', '--compileconfig={0}'.format(compile_config), '--html=compile.html', '--self-contained-html'])
         # breakpoint()
-        pytest.main([
+        pytest_args = [
             pytest_file,
             '-x',  # Stop on first failure 
             '-n={0}'.format(self.jobs),
@@ -292,20 +447,37 @@ class chromite_cadence_plugin(object):
             '--html={0}.html'.format(self.work_dir + '/reports/' + self.name),
             '--report-log={0}.json'.format(report_file_name),
             '--work_dir={0}'.format(self.work_dir),
-            '--make_file={0}'.format(self.make_file),
-            '--key_list={0}'.format(self.test_names),
+            '--cmd_file={0}'.format(self.cmd_file),
+            '--key_file={0}'.format(self.key_file),
             '--log-cli-level=DEBUG',
             '-o log_cli=true',
-        ])
+        ]
+        merger = None
+        if self.coverage and self.stream_coverage:
+            self.stream_cov_dir = self.work_dir + 'stream_coverage'
+            shutil.rmtree(self.stream_cov_dir, ignore_errors=True)
+            merger = CoverageMerger(self.fold_coverage)
+        scheduling.run_priority_first(
+            pytest_args, report_file_name, self.key_file, self.test_names,
+            priority, [merger] if merger else None)
         # , '--regress_list={0}'.format(self.regress_list), '-v', '--compile_config={0}'.format(compile_config),
 
         if self.coverage:
             merge_cmd = 'merge -out ' + self.work_dir + '/reports/' + '/final_coverage '
             rank_cmd = 'rank -out ' + self.work_dir + '/reports/' + '/final_rank -runfile ' + self.work_dir + '/run_list -html'
+            merged = set()
+            if merger is not None:
+                merged = merger.finish()
+                logger.info(
+                    'Coverage of {0} tests merged during the run'.format(
+                        len(merged)))
+                if merged:
+                    merge_cmd += ' ' + self.stream_cov_dir
             logger.info('Initiating Merging of coverage files')
             for test, attr in self.test_list.items():
                 test_wd = attr['work_dir']
-                merge_cmd += ' ' + test_wd + '/cov_work/scope/' + test + '/'
+                if test not in merged:
+                    merge_cmd += ' ' + test_wd + '/cov_work/scope/' + test + '/'
                 #rank_cmd += ' ' + test_wd + '/cov_work/scope/' + test + '/'
                 with open(self.work_dir + '/run_list', 'a+') as r:
                     r.write(test_wd + '/cov_work/scope/' + test + '/ \n')
@@ -322,14 +494,62 @@ class chromite_cadence_plugin(object):
             os.chdir(self.work_dir)
             (ret, out, error) = sys_command('imc -exec merge_imc.cmd')
             os.chdir(orig_path)
+            if merged:
+                shutil.rmtree(self.stream_cov_dir)
 
             logger.info('Final coverage file is at: {0}'.format(
                 self.work_dir + '/reports/final_coverage_html'))
             logger.info(
                 'Final rank file is at: {0}'.format(self.work_dir +
                                                     '/reports/final_rank'))
+        if self.elf_cache:
+            logger.debug('Limiting ELF cache to {0} MB'.format(
+                self.elf_cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'result_cache.py'), self.elf_cache_dir,
+                self.elf_cache_size))
+        scheduling.record_durations(report_file_name + '.json',
+                                    self.history_file, self.test_list)
         return report_file_name
 
+    def fold_coverage(self, test):
+        '''
+            Merge the coverage run of a test into the running aggregate of the
+            run
+
+            :param test: name of the test
+
+            :type test: str
+
+            :return: True if the coverage of the test was merged
+
+            :rtype: bool
+        '''
+        if test not in self.test_list:
+            return False
+        scope = self.test_list[test]['work_dir'] + '/cov_work/scope/' + test
+        if not os.path.isdir(scope):
+            return False
+        stream_tmp = self.stream_cov_dir + '_tmp'
+        merge_cmd = 'merge -overwrite -out {0} {1}'.format(stream_tmp, scope)
+        if os.path.isdir(self.stream_cov_dir):
+            merge_cmd += ' ' + self.stream_cov_dir
+        with open(self.work_dir + 'stream_imc.cmd', 'w') as f:
+            f.write(merge_cmd + '\n')
+        # The tests are still running, so imc is started in the work_dir
+        # through a shell instead of changing the directory of the process
+        (ret, out, err) = sys_command(
+            shlex.join([
+                'sh', '-c',
+                'cd {0} && imc -exec stream_imc.cmd'.format(self.work_dir)
+            ]))
+        if ret != 0 or not os.path.isdir(stream_tmp):
+            return False
+        shutil.rmtree(self.stream_cov_dir, ignore_errors=True)
+        os.rename(stream_tmp, self.stream_cov_dir)
+        return True
+
     @dut_hookimpl
     def post_run(self, test_dict, config):
 
@@ -362,6 +582,10 @@ class chromite_cadence_plugin(object):
                     logger.debug("Removing extra files for Test: " + str(test))
                     work_dir = test_dict[test]['work_dir']
                     # List of all files deemed uncessary to reduce space usage
+                    # The coverage of the test was merged during the run
+                    if self.coverage and self.stream_coverage:
+                        shutil.rmtree(work_dir + '/cov_work',
+                                      ignore_errors=True)
                     try:
                         os.remove(work_dir + '/app_log')
                         os.remove(work_dir + '/code.mem')
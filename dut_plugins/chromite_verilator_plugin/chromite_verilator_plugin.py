@@ -3,18 +3,268 @@
 import os
 import sys
 import pluggy
+import importlib.util
 import shutil
 import random
 import re
 import datetime
 import pytest
 import glob
+import queue
+import threading
+import hashlib
+import concurrent.futures
+import json
+import resource
 
 from river_core.log import logger
 from river_core.utils import *
 
 dut_hookimpl = pluggy.HookimplMarker('dut')
 
+# Test scheduling shared by the plugins, an identical copy of scheduling.py
+# is kept next to every plugin
+scheduling_spec = importlib.util.spec_from_file_location(
+    __name__ + '_scheduling',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scheduling.py'))
+scheduling = importlib.util.module_from_spec(scheduling_spec)
+scheduling_spec.loader.exec_module(scheduling)
+
+
+def hash_paths(paths, *args):
+    '''
+        Compute a sha256 digest over a list of strings and the contents of
+        files. Directories are walked recursively in a stable order so that
+        the digest only changes when the content (or layout) changes.
+
+        :param paths: List of files/directories to hash
+
+        :param args: Extra values (command lines, versions) to mix into the digest
+
+        :returns: hex digest
+
+        :rtype: str
+    '''
+    digest = hashlib.sha256()
+    for arg in args:
+        digest.update(str(arg).encode())
+        digest.update(b'\0')
+    for path in paths:
+        if os.path.isdir(path):
+            files = []
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, x) for x in sorted(names))
+            base = path
+        else:
+            files = [path]
+            base = os.path.dirname(path)
+        for name in files:
+            digest.update(os.path.relpath(name, base).encode())
+            digest.update(b'\0')
+            if not os.path.isfile(name):
+                continue
+            with open(name, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_summary(report_file):
+    '''
+        Function to log a histogram of the runtime of each stage over all
+        the tests of a report-log
+
+        :param report_file: report-log JSON of the run
+
+        :type report_file: str
+    '''
+    if not os.path.isfile(report_file):
+        return
+    buckets = [0.1, 1, 10, 100, 1000]
+    stages = {}
+    with open(report_file, 'r') as report:
+        for line in report:
+            entry = json.loads(line)
+            if entry.get('$report_type', None) != 'TestReport' or \
+                    entry['when'] != 'call':
+                continue
+            for name, value in entry.get('user_properties', []):
+                if name != 'stages':
+                    continue
+                for record in value:
+                    stages.setdefault(record['stage'], []).append(record)
+
+    logger.info('Stage timing summary')
+    for stage, records in stages.items():
+        runtimes = [x['end'] - x['start'] for x in records]
+        counts = [0] * (len(buckets) + 1)
+        for runtime in runtimes:
+            index = 0
+            while index < len(buckets) and runtime >= buckets[index]:
+                index += 1
+            counts[index] += 1
+        logger.info(
+            '{0:<14} runs: {1:<6} total: {2:>10.2f}s mean: {3:>8.2f}s '
+            'max: {4:>8.2f}s failed: {5:<5} peak RSS: {6} MB'.format(
+                stage, len(runtimes), sum(runtimes),
+                sum(runtimes) / len(runtimes), max(runtimes),
+                len([x for x in records if x['exit'] != 0]),
+                max(x['max_rss_kb'] for x in records) // 1024))
+        labels = ['<{0}s'.format(x) for x in buckets] + \
+                 ['>={0}s'.format(buckets[-1])]
+        logger.info('{0:<14} '.format('') + ' | '.join(
+            '{0}: {1}'.format(label, count)
+            for label, count in zip(labels, counts)))
+
+
+def spike_args(isa, test_isa, xlen):
+    '''
+        Function to derive the spike arguments used by the spike plugin
+
+        :param isa: isa of the core from the ini
+
+        :param test_isa: isa of the test from the test list
+
+        :param xlen: xlen of the core
+
+        :return: spike priv and isa strings
+
+        :rtype: tuple
+    '''
+    spike_isa = 'rv' + str(xlen) + 'i'
+    spike_isa += 'm' if 'M' in isa or 'G' in isa else ''
+    spike_isa += 'a' if 'A' in isa or 'G' in isa else ''
+    spike_isa += 'f' if 'F' in isa or 'G' in isa else ''
+    spike_isa += 'd' if 'D' in isa or 'G' in isa else ''
+    spike_isa += 'c' if 'C' in isa or 'G' in isa else ''
+    spike_isa += 'h' if 'H' in isa else ''
+    spike_isa += '_zba' if 'Zba' in isa else ''
+    spike_isa += '_zbb' if 'Zbb' in isa else ''
+    spike_isa += '_zbc' if 'Zbc' in isa else ''
+    spike_isa += '_zbs' if 'Zbs' in isa else ''
+
+    spike_priv = 'm'
+    if 'S' in test_isa:
+        spike_priv += 'su'
+    elif 'U' in test_isa:
+        spike_priv += 'u'
+    return spike_priv, spike_isa
+
+
+def merge_coverage(cov_files, final_cov_file, jobs, fan_in=64):
+    '''
+        Function to merge verilator coverage files in a tree. The files are
+        merged in groups of fan_in files, up to jobs groups at a time, and
+        the intermediate files are merged again until a single group is
+        left, which is merged into final_cov_file. As verilator_coverage
+        adds up the counts of the files, the result is the same as merging
+        every file at once.
+
+        :param cov_files: coverage files of the tests
+
+        :param final_cov_file: merged coverage file
+
+        :param jobs: number of merges run in parallel
+
+        :param fan_in: number of files merged by a single verilator_coverage
+
+        :type cov_files: list
+
+        :type final_cov_file: str
+
+        :type jobs: int
+
+        :type fan_in: int
+
+        :return: True if every merge succeeded
+
+        :rtype: bool
+    '''
+    merge_dir = final_cov_file + '.merge'
+    shutil.rmtree(merge_dir, ignore_errors=True)
+    os.makedirs(merge_dir)
+
+    def merge(output, inputs):
+        (ret, out, err) = sys_command(
+            'verilator_coverage -write {0} {1}'.format(output,
+                                                       ' '.join(inputs)))
+        if ret != 0:
+            logger.error('Merging coverage into {0} failed'.format(output))
+        return ret == 0
+
+    success = True
+    level = 0
+    while len(cov_files) > fan_in:
+        groups = [
+            cov_files[index:index + fan_in]
+            for index in range(0, len(cov_files), fan_in)
+        ]
+        outputs = [
+            '{0}/level{1}_{2}.dat'.format(merge_dir, level, index)
+            for index in range(len(groups))
+        ]
+        logger.info('Merging {0} coverage files in {1} groups'.format(
+            len(cov_files), len(groups)))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+            success = all(pool.map(merge, outputs, groups)) and success
+        cov_files = outputs
+        level += 1
+    success = merge(final_cov_file, cov_files) and success
+    shutil.rmtree(merge_dir, ignore_errors=True)
+    return success
+
+
+class CoverageMerger(object):
+    '''
+        Pytest plugin merging the coverage of every test into a running
+        aggregate as soon as the test finishes. The merges are done one at a
+        time by a background thread so that the dispatch of the tests is not
+        held up.
+
+        :param fold: function merging the coverage of a test, given its name,
+            into the aggregate and returning True when it was merged
+
+        :type fold: function
+    '''
+
+    def __init__(self, fold):
+        self.fold = fold
+        self.merged = set()
+        self.tests = queue.Queue()
+        self.thread = threading.Thread(target=self.merge_tests, daemon=True)
+        self.thread.start()
+
+    def pytest_runtest_logreport(self, report):
+        # With xdist the reports of the workers are passed on to this hook in
+        # the controlling process
+        if report.when == 'call':
+            self.tests.put(report.nodeid.rsplit('[', 1)[-1][:-1])
+
+    def merge_tests(self):
+        while True:
+            test = self.tests.get()
+            if test is None:
+                break
+            try:
+                if self.fold(test):
+                    self.merged.add(test)
+            except Exception as e:
+                logger.error('Merging coverage of {0} failed: {1}'.format(
+                    test, e))
+
+    def finish(self):
+        '''
+            Wait for the pending merges to complete
+
+            :return: names of the tests whose coverage is in the aggregate
+
+            :rtype: set
+        '''
+        self.tests.put(None)
+        self.thread.join()
+        return self.merged
+
 
 class chromite_verilator_plugin(object):
     '''
@@ -33,6 +283,41 @@ class chromite_verilator_plugin(object):
             self.stop_on_failure = ini_config['stop_on_failure']
         else:
             self.stop_on_failure = False
+        # Persistent cache for artifacts which can be reused across runs
+        if 'cache_dir' in ini_config:
+            self.cache_dir = os.path.abspath(ini_config['cache_dir'])
+        else:
+            self.cache_dir = os.path.abspath(work_dir) + '/.cache'
+        # Number of tests simulated by a single chromite_core process. When
+        # 0, every test is simulated by its own process.
+        if 'batch_size' in ini_config:
+            self.batch_size = int(ini_config['batch_size'])
+        else:
+            self.batch_size = 0
+        # The files opened by the model of every test of a batch (rtl.dump,
+        # signature and app_log) stay open until the chromite_core process
+        # exits, so a batch must fit in the limit of open files.
+        open_files = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+        if open_files != resource.RLIM_INFINITY:
+            max_batch_size = max(1, (open_files - 64) // 3)
+            if self.batch_size > max_batch_size:
+                logger.warn(
+                    'batch_size reduced to {0} to stay within the limit of '
+                    '{1} open files'.format(max_batch_size, open_files))
+                self.batch_size = max_batch_size
+        # Run spike along with the simulator and compare the commit logs while
+        # they are produced, stopping both at the first mismatch. The spike
+        # plugin must be configured with lockstep as well.
+        if 'lockstep' in ini_config:
+            self.lockstep = str_2_bool(ini_config['lockstep'])
+        else:
+            self.lockstep = False
+        if self.lockstep and self.batch_size:
+            logger.error('lockstep and batch_size cannot be used together')
+            raise SystemExit
+        if self.lockstep and shutil.which('spike') is None:
+            logger.error('Spike not available in $PATH, required for lockstep')
+            raise SystemExit
 
         self.top_module = ini_config['top_module']
 
@@ -60,19 +345,112 @@ class chromite_verilator_plugin(object):
 
         self.elfmem = ini_config['elfmem']
 
+        # Create code.mem holding only the populated words of the ELF
+        # instead of running elf2hex over the whole memory. The testbench
+        # then zeroes the memory, given as <module>.<variable> in
+        # sparse_mem_var, before loading the image (+sparsemem).
+        if 'sparse_mem' in ini_config:
+            self.sparse_mem = str_2_bool(ini_config['sparse_mem'])
+        else:
+            self.sparse_mem = False
+        if self.sparse_mem:
+            if '.' not in ini_config.get('sparse_mem_var', ''):
+                logger.error('sparse_mem needs the memory of the design as '
+                             'sparse_mem_var = <module>.<variable>')
+                raise SystemExit
+            self.sparse_mem_var = ini_config['sparse_mem_var'].strip().rsplit(
+                '.', 1)
+        self.elf2hex_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'elf2hex.py')
+
         filesize = str(int(4194304*64/self.xlen))
         if self.elfmem:
             self.elf2hex_cmd = ''
             self.cpp_files = f'{self.chromite_root}/test_soc/sim_main.cpp {self.chromite_root}/devices/elfmem/elfmem.cpp'
-            self.sim_args = '+elf=dut.elf +rtldump > /dev/null'
+            self.sim_plusargs = '+elf=dut.elf +rtldump'
+        elif self.sparse_mem:
+            self.elf2hex_cmd = '{0} {1} {2} dut.elf 2147483648 > code.mem'.format(self.elf2hex_script, str(int(self.xlen / 8)), filesize)
+            self.cpp_files = ''
+            self.sim_plusargs = '+sparsemem={0} +rtldump'.format(
+                self.sparse_mem_var[1])
         else:
-            self.elf2hex_cmd = 'elf2hex {0} {1} dut.elf 2147483648 > code.mem && '.format(str(int(self.xlen / 8)), filesize)
+            self.elf2hex_cmd = 'elf2hex {0} {1} dut.elf 2147483648 > code.mem'.format(str(int(self.xlen / 8)), filesize)
             self.cpp_files = ''
-            self.sim_args = '+rtldump > /dev/null'
-        self.objdump_cmd = ''#riscv{0}-unknown-elf-objdump -D dut.elf > dut.disass && '.format( self.xlen)
+            self.sim_plusargs = '+rtldump'
+        self.sim_args = self.sim_plusargs + ' > /dev/null'
+        self.lockstep_script = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'lockstep.py')
+        self.objdump_cmd = ''#riscv{0}-unknown-elf-objdump -D dut.elf > dut.disass'.format( self.xlen)
         self.sim_cmd = './chromite_core'
         self.clean_up = 'rm -f code.mem app_log signature'
-
+        # Self-checking tests report their result in the signature, which
+        # river_core checks as dut.signature instead of comparing the dumps
+        self.self_check_cmd = 'cp signature dut.signature'
+
+        # Tests are compiled once into a shared ELF in the test work_dir which
+        # is reused by the other plugins running the same test.
+        self.compile_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link dut.elf --'
+        # The ELFs of static suites, whose sources are the same in every
+        # regression, are also kept in a persistent cache bounded to
+        # elf_cache_size MB
+        if 'elf_cache' in ini_config:
+            self.elf_cache = str_2_bool(ini_config['elf_cache'])
+        else:
+            self.elf_cache = True
+        if 'elf_cache_generators' in ini_config:
+            self.elf_cache_generators = [
+                x.strip() for x in ini_config['elf_cache_generators'].split(',')
+            ]
+        else:
+            self.elf_cache_generators = ['riscv_tests', 'riscof', 'ctg']
+        if 'elf_cache_size' in ini_config:
+            self.elf_cache_size = int(ini_config['elf_cache_size'])
+        else:
+            self.elf_cache_size = 2048
+        self.elf_cache_dir = os.path.join(self.cache_dir, 'elf')
+        self.elf_cache_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link dut.elf --cache {0} --'.format(
+                self.elf_cache_dir)
+        # Run the tests which failed in the previous run and the smoke tests
+        # (comma separated fnmatch patterns of test names) ahead of the
+        # regression, in a pytest session of their own
+        if 'fast_feedback' in ini_config:
+            self.fast_feedback = str_2_bool(ini_config['fast_feedback'])
+        else:
+            self.fast_feedback = False
+        if 'smoke' in ini_config:
+            self.smoke = [
+                x.strip() for x in ini_config['smoke'].split(',') if x.strip()
+            ]
+        else:
+            self.smoke = []
+        # Merge the coverage of every test into a running aggregate while
+        # the regression runs instead of merging all of them at the end
+        if 'stream_coverage' in ini_config:
+            self.stream_coverage = str_2_bool(ini_config['stream_coverage'])
+        else:
+            self.stream_coverage = False
+        # The simulation of a test is skipped when its ELF, the simulator,
+        # the boot image and the simulator arguments are unchanged since a
+        # previous run. dut.dump (and the signature of self-checking tests)
+        # and the exit status are then restored from a persistent cache.
+        if 'result_cache' in ini_config:
+            self.result_cache = str_2_bool(ini_config['result_cache'])
+        else:
+            self.result_cache = False
+        if self.result_cache and self.coverage:
+            logger.warn('result_cache is ignored when coverage is enabled')
+            self.result_cache = False
+        if 'cache_size' in ini_config:
+            self.cache_size = int(ini_config['cache_size'])
+        else:
+            self.cache_size = 10240
+        self.result_cache_dir = os.path.join(self.cache_dir, self.name)
+        self.result_cache_script = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'result_cache.py')
         self.work_dir = os.path.abspath(work_dir) + '/'
 
         self.sim_path = self.work_dir + self.name
@@ -81,6 +459,8 @@ class chromite_verilator_plugin(object):
         self.test_list = load_yaml(test_list)
 
         self.json_dir = self.work_dir + '/.json/'
+        # Runtimes of the tests in previous runs, used to schedule them
+        self.history_file = self.json_dir + 'history_' + self.name + '.json'
 
         # Check if dir exists
         if (os.path.isdir(self.json_dir)):
@@ -96,7 +476,7 @@ class chromite_verilator_plugin(object):
             logger.error(f'Path: {self.chromite_root} does not exist')
             raise SystemExit
 
-        if shutil.which('elf2hex') is None:
+        if not (self.elfmem or self.sparse_mem) and shutil.which('elf2hex') is None:
             logger.error('elf2hex utility not found in $PATH')
             raise SystemExit
 
@@ -142,6 +522,15 @@ class chromite_verilator_plugin(object):
             )
             verilator_command = verilator_command.format('')
 
+        if self.sparse_mem:
+            # Only the memory is made public, so that the testbench can zero
+            # it without touching the reset of the rest of the design
+            with open(self.sim_path + '/sparse_mem.vlt', 'w') as vlt:
+                vlt.write('`verilator_config\n')
+                vlt.write('public_flat_rw -module "{0}" -var "{1}"\n'.format(
+                    *self.sparse_mem_var))
+            verilator_command += ' sparse_mem.vlt'
+
         # create simulation header files
         sim_header = open(self.sim_path + '/sim_main.h', 'w')
         sim_header.write('#define TOPMODULE V{0}\n'.format(self.top_module))
@@ -152,19 +541,55 @@ class chromite_verilator_plugin(object):
         shutil.copy(self.plugin_path + self.name + '_plugin/sim_main.cpp',
                     self.sim_path)
 
-        sys_command(verilator_command, 500)
-        logger.info("Linking verilator simulation sources")
+        # The binary only depends on the verilog sources, the testbench, the
+        # verilator command line and the verilator version. Reuse a previous
+        # build if none of them have changed.
+        (ret, verilator_version, err) = sys_command('verilator --version')
+        build_sources = [f'{self.chromite_root}/build/hw/verilog/',
+                         self.sim_path + '/sim_main.cpp',
+                         self.sim_path + '/sim_main.h'] + self.cpp_files.split()
         if self.elfmem:
-            sys_command(f"ln -f -s {self.chromite_root}/elfio/elfio obj_dir/elfio")
-            sys_command(f"ln -f -s {self.chromite_root}/devices/elfmem/elfmem.cpp obj_dir/elfmem.cpp")
-        sys_command("ln -f -s ../sim_main.cpp obj_dir/sim_main.cpp")
-        sys_command("ln -f -s ../sim_main.h obj_dir/sim_main.h")
-        make_command = 'make ' + self.verilator_speed + ' VM_PARALLEL_BUILDS=1 -j' + self.jobs + ' -C obj_dir -f V' + self.top_module + '.mk'
-        logger.info("Making verilator binary")
-        sys_command(make_command, 500)
-        logger.info('Renaming verilator Binary')
-        shutil.copy(self.sim_path + '/obj_dir/V{0}'.format(self.top_module),
-                    self.sim_path + '/chromite_core')
+            build_sources.append(f'{self.chromite_root}/elfio/elfio')
+        if self.sparse_mem:
+            build_sources.append(self.sim_path + '/sparse_mem.vlt')
+        build_key = hash_paths(build_sources, verilator_command,
+                               self.verilator_speed, verilator_version)
+        build_cache = os.path.join(self.cache_dir, 'verilator', build_key)
+
+        if os.path.isfile(build_cache + '/chromite_core'):
+            logger.info('Reusing cached verilator build: ' + build_key)
+            shutil.copy(build_cache + '/chromite_core',
+                        self.sim_path + '/chromite_core')
+        else:
+            (ret, out, err) = sys_command(verilator_command, 500)
+            if ret != 0:
+                logger.error('Verilating the design failed')
+                raise SystemExit
+            logger.info("Linking verilator simulation sources")
+            if self.elfmem:
+                sys_command(f"ln -f -s {self.chromite_root}/elfio/elfio obj_dir/elfio")
+                sys_command(f"ln -f -s {self.chromite_root}/devices/elfmem/elfmem.cpp obj_dir/elfmem.cpp")
+            sys_command("ln -f -s ../sim_main.cpp obj_dir/sim_main.cpp")
+            sys_command("ln -f -s ../sim_main.h obj_dir/sim_main.h")
+            make_command = 'make ' + self.verilator_speed + ' VM_PARALLEL_BUILDS=1 -j' + self.jobs + ' -C obj_dir -f V' + self.top_module + '.mk'
+            # obj_dir is kept across runs, the binary of a previous build must
+            # not be taken for the result of this one
+            binary = self.sim_path + '/obj_dir/V{0}'.format(self.top_module)
+            if os.path.exists(binary):
+                os.remove(binary)
+            logger.info("Making verilator binary")
+            (ret, out, err) = sys_command(make_command, 500)
+            if ret != 0 or not os.path.isfile(binary):
+                logger.error('Building the verilator binary failed')
+                raise SystemExit
+            logger.info('Renaming verilator Binary')
+            shutil.copy(binary, self.sim_path + '/chromite_core')
+            logger.info('Caching verilator build: ' + build_key)
+            os.makedirs(build_cache, exist_ok=True)
+            shutil.copy(self.sim_path + '/chromite_core',
+                        build_cache + '/chromite_core.tmp')
+            os.replace(build_cache + '/chromite_core.tmp',
+                       build_cache + '/chromite_core')
 
         logger.info('Creating boot-files')
         sys_command('make -C {0} XLEN={1}'.format(
@@ -185,7 +610,21 @@ class chromite_verilator_plugin(object):
             self.name))
         make.makeCommand = 'make -j1'
         self.make_file = os.path.join(self.work_dir, 'Makefile.' + self.name)
+        self.cmd_file = os.path.join(self.work_dir,
+                                     'commands.' + self.name + '.json')
+        self.key_file = os.path.join(self.work_dir,
+                                     'tests.' + self.name + '.list')
         self.test_names = []
+        test_commands = {}
+        if self.result_cache:
+            # Identify the simulator and the boot image once, the ELF and the
+            # command line are part of the key of every test
+            sim_key = hash_paths([self.sim_path + '/chromite_core',
+                                  self.sim_path + '/boot.mem'])
+            result_cache_cmd = 'python3 {0} run --cache {1} '.format(
+                self.result_cache_script, self.result_cache_dir)
+            result_cache_cmd += '--salt {0} '.format(sim_key)
+            result_cache_cmd += '--input dut.elf --output dut.dump'
 
         for test, attr in self.test_list.items():
             logger.debug('Creating Make Target for ' + str(test))
@@ -201,7 +640,12 @@ class chromite_verilator_plugin(object):
             skip_lines = attr['ignore_lines'] if 'ignore_lines' in attr else 4
 
             ch_cmd = 'cd {0} && '.format(work_dir)
-            compile_cmd = '{0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
+            compile_script = self.compile_script
+            if self.elf_cache and \
+                    attr.get('generator') in self.elf_cache_generators:
+                compile_script = self.elf_cache_script
+            compile_cmd = compile_script + \
+                    ' {0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
                     cc, cc_args, arch, abi, link_args, link_file, asm_file)
             for x in attr['extra_compile']:
                 compile_cmd += ' ' + x
@@ -209,17 +653,62 @@ class chromite_verilator_plugin(object):
                 compile_cmd += ' -I ' + str(x)
             compile_cmd += ' '.join(map(' -D{0}'.format,
                                         attr['compile_macros']))
-            compile_cmd += ' -o dut.elf && '
             sim_setup = 'ln -f -s ' + self.sim_path + '/chromite_core . && '
             sim_setup += 'ln -f -s ' + self.sim_path + '/boot.mem . && '
             post_process_cmd = f'head -n -{skip_lines} rtl.dump > dut.dump && rm -f rtl.dump'
-            target_cmd = ch_cmd + compile_cmd + self.objdump_cmd +\
-                    self.elf2hex_cmd + sim_setup + self.sim_cmd + ' ' + \
-                    self.sim_args + ' && '+ post_process_cmd + \
-                    ' && ' + self.clean_up
+            clean_up = self.clean_up
+            if attr.get('self_checking', False):
+                clean_up = self.self_check_cmd + ' && ' + clean_up
+
+            # Stages of the test, each run from the work_dir of the test
+            stages = [['compile', compile_cmd]]
+            if self.objdump_cmd:
+                stages.append(['objdump', self.objdump_cmd])
+            if self.elf2hex_cmd:
+                stages.append(['elf2hex', self.elf2hex_cmd])
+            if self.batch_size:
+                # Only prepare the test here, it is simulated by one of the
+                # batches created in run()
+                stages.insert(0, ['clean',
+                                  'rm -f dut.dump dut.signature rtl.dump'])
+                stages.append(['setup',
+                               'ln -f -s ' + self.sim_path + '/boot.mem .'])
+            elif self.lockstep:
+                spike_priv, spike_isa = spike_args(self.riscv_isa, isa,
+                                                   self.xlen)
+                lockstep_cmd = 'python3 {0} --ignore-lines {1} '.format(
+                    self.lockstep_script, skip_lines)
+                lockstep_cmd += '--dut "{0} {1}" '.format(self.sim_cmd,
+                                                          self.sim_plusargs)
+                lockstep_cmd += '--ref "spike --log-commits --priv={0} '.format(
+                    spike_priv)
+                lockstep_cmd += '--isa={0} dut.elf"'.format(spike_isa)
+                stages.append(['simulate', sim_setup + lockstep_cmd])
+                stages.append(['post_process', clean_up])
+            elif self.result_cache:
+                cached_cmd = result_cache_cmd
+                if attr.get('self_checking', False):
+                    cached_cmd += ' --output signature'
+                cached_cmd += " -- sh -c '{0} {1} && {2}'".format(
+                    self.sim_cmd, self.sim_args, post_process_cmd)
+                stages.append(['simulate', sim_setup + cached_cmd])
+                stages.append(['post_process', clean_up])
+            else:
+                stages.append(['simulate', sim_setup + self.sim_cmd + ' ' +
+                               self.sim_args])
+                stages.append(['post_process',
+                               post_process_cmd + ' && ' + clean_up])
+            target_cmd = ch_cmd + ' && '.join(cmd for stage, cmd in stages)
             make.add_target(target_cmd, test)
+            test_commands[test] = {'work_dir': work_dir, 'stages': stages}
             self.test_names.append(test)
 
+        with open(self.cmd_file, 'w') as cmd_file:
+            json.dump(test_commands, cmd_file)
+        # Manifest of the tests to run, one name per line
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
     @dut_hookimpl
     def run(self, module_dir):
         logger.info('Run Hook')
@@ -227,9 +716,21 @@ class chromite_verilator_plugin(object):
         pytest_file = module_dir + '/chromite_verilator_plugin/gen_framework.py'
         logger.debug('Pytest file: {0}'.format(pytest_file))
 
+        # Dispatch the tests with the longest expected runtime first
+        self.test_names = scheduling.order_tests(self.test_names,
+                                                 self.test_list,
+                                                 self.history_file)
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
         report_file_name = '{0}/{1}_{2}'.format(
             self.json_dir, self.name,
             datetime.datetime.now().strftime("%Y%m%d-%H%M"))
+        priority = []
+        if self.fast_feedback:
+            priority = scheduling.priority_tests(
+                self.test_names, self.json_dir, self.name,
+                os.path.join(self.work_dir, 'failed_list.yaml'), self.smoke)
 
         # TODO Regression list currently removed, check back later
         # TODO The logger doesn't exactly work like in the pytest module
@@ -240,22 +741,41 @@ class chromite_verilator_plugin(object):
             '--html={0}.html'.format(self.work_dir + '/reports/' + self.name),
             '--report-log={0}.json'.format(report_file_name),
             '--work_dir={0}'.format(self.work_dir),
-            '--make_file={0}'.format(self.make_file),
-            '--key_list={0}'.format(self.test_names),
+            '--cmd_file={0}'.format(self.cmd_file),
+            '--key_file={0}'.format(self.key_file),
             '--log-cli-level=DEBUG',
             '-o log_cli=true',]
         if self.stop_on_failure:
             pytest_args.append('-x')
-        pytest_state = pytest.main(pytest_args)
+        merger = None
+        if self.coverage and self.stream_coverage and \
+                shutil.which('verilator_coverage') is not None:
+            self.stream_cov_file = self.work_dir + 'stream_coverage.dat'
+            if os.path.exists(self.stream_cov_file):
+                os.remove(self.stream_cov_file)
+            merger = CoverageMerger(self.fold_coverage)
+        pytest_state = scheduling.run_priority_first(
+            pytest_args, report_file_name, self.key_file, self.test_names,
+            priority, [merger] if merger else None)
         if pytest_state == (pytest.ExitCode.INTERRUPTED or
                             pytest.ExitCode.TESTS_FAILED):
             logger.error(
                 'DuT Plugin failed to compile tests, exiting river_core')
 
+        if self.batch_size:
+            self.run_batches(pytest_file, report_file_name)
+
         if self.coverage:
             final_cov_file = self.work_dir + '/final_coverage.dat'
-            coverage_cmd = 'verilator_coverage -write {0}'.format(
-                final_cov_file)
+            cov_files = []
+            merged = set()
+            if merger is not None:
+                merged = merger.finish()
+                logger.info(
+                    'Coverage of {0} tests merged during the run'.format(
+                        len(merged)))
+                if merged:
+                    cov_files.append(self.stream_cov_file)
             logger.info('Initiating Merging of coverage files')
             if shutil.which('verilator_coverage') is None:
                 logger.error('verilator_coverage missing from $PATH')
@@ -266,9 +786,14 @@ class chromite_verilator_plugin(object):
                     logger.error(\
                             'Coverage enabled but coverage file for test: '+\
                             test + ' is missing')
-                else:
-                    coverage_cmd += ' ' + test_wd + '/coverage.dat'
-            sys_command(coverage_cmd)
+                elif test not in merged:
+                    cov_files.append(test_wd + '/coverage.dat')
+            if merged and len(cov_files) == 1:
+                os.replace(self.stream_cov_file, final_cov_file)
+            else:
+                merge_coverage(cov_files, final_cov_file, int(self.jobs))
+                if merged:
+                    os.remove(self.stream_cov_file)
             logger.info('Final coverage file is at: {0}'.format(final_cov_file))
             logger.info('Annotating source files with final_coverage.dat')
             sys_command(\
@@ -277,8 +802,158 @@ class chromite_verilator_plugin(object):
             logger.info(
                 'Annotated source available at: {0}/annotated_src'.format(
                     self.work_dir))
+        if self.elf_cache:
+            logger.debug('Limiting ELF cache to {0} MB'.format(
+                self.elf_cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'result_cache.py'), self.elf_cache_dir,
+                self.elf_cache_size))
+        if self.result_cache:
+            logger.debug('Limiting result cache to {0} MB'.format(
+                self.cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                self.result_cache_script, self.result_cache_dir,
+                self.cache_size))
+        scheduling.record_durations(report_file_name + '.json',
+                                    self.history_file, self.test_list)
+        stage_summary(report_file_name + '.json')
         return report_file_name
 
+    def run_batches(self, pytest_file, report_file_name):
+        '''
+            Simulate the tests prepared by the first pytest session in
+            batches of batch_size tests, each batch running in a single
+            chromite_core process. The reports of the batches are appended to
+            the report of the first session.
+
+            :param pytest_file: path of gen_framework.py
+
+            :param report_file_name: report of the first session without the
+                .json extension
+
+            :type pytest_file: str
+
+            :type report_file_name: str
+        '''
+        # Tests which failed to compile are not simulated
+        ready = []
+        with open(report_file_name + '.json', 'r') as report:
+            for line in report:
+                entry = json.loads(line)
+                if entry.get('$report_type', None) == 'TestReport' and \
+                        entry['when'] == 'call' and \
+                        entry['outcome'] == 'passed':
+                    ready.append(entry['nodeid'].rsplit('[', 1)[-1][:-1])
+
+        batch_dir = self.work_dir + '.batch/'
+        os.makedirs(batch_dir, exist_ok=True)
+        make_file = os.path.join(self.work_dir,
+                                 'Makefile.' + self.name + '_batch')
+        make = makeUtil(makefilePath=make_file)
+        make.makeCommand = 'make -j1'
+        cmd_file = os.path.join(self.work_dir,
+                                'commands.' + self.name + '_batch.json')
+        batch_names = []
+        batch_commands = {}
+        for index in range(0, len(ready), self.batch_size):
+            batch = ready[index:index + self.batch_size]
+            batch_name = 'batch_{0}'.format(index // self.batch_size)
+            list_file = batch_dir + batch_name + '.list'
+            with open(list_file, 'w') as batch_list:
+                for test in batch:
+                    batch_list.write(self.test_list[test]['work_dir'] + '\n')
+            sim_cmd = '{0} +batch={1} {2}'.format(self.sim_cmd, list_file,
+                                                  self.sim_args)
+            # A failing post-process only affects the test itself, whose
+            # dump is then reported as mismatching.
+            post_process_cmd = []
+            for test in batch:
+                attr = self.test_list[test]
+                skip_lines = attr['ignore_lines'] if 'ignore_lines' in attr else 4
+                cmd = '(cd {0} && head -n -{1} rtl.dump > dut.dump'.format(
+                    attr['work_dir'], skip_lines)
+                clean_up = self.clean_up
+                if attr.get('self_checking', False):
+                    clean_up = self.self_check_cmd + ' && ' + clean_up
+                cmd += ' && rm -f rtl.dump && {0} ; true)'.format(clean_up)
+                post_process_cmd.append(cmd)
+            stages = [['simulate', sim_cmd],
+                      ['post_process', ' && '.join(post_process_cmd)]]
+            target_cmd = 'cd {0} && '.format(self.sim_path) + \
+                    ' && '.join(cmd for stage, cmd in stages)
+            make.add_target(target_cmd, batch_name)
+            batch_commands[batch_name] = {'work_dir': self.sim_path,
+                                          'stages': stages}
+            batch_names.append(batch_name)
+
+        with open(cmd_file, 'w') as batch_cmd_file:
+            json.dump(batch_commands, batch_cmd_file)
+        key_file = os.path.join(self.work_dir,
+                                'tests.' + self.name + '_batch.list')
+        with open(key_file, 'w') as batch_key_file:
+            batch_key_file.write(''.join(name + '\n' for name in batch_names))
+
+        if not batch_names:
+            logger.error('No tests available for batch simulation')
+            return
+        logger.info('Simulating {0} tests in {1} batches'.format(
+            len(ready), len(batch_names)))
+        pytest_args = [
+            pytest_file,
+            '-n={0}'.format(self.jobs),
+            '--html={0}.html'.format(self.work_dir + '/reports/' + self.name +
+                                     '_batch'),
+            '--report-log={0}_batch.json'.format(report_file_name),
+            '--work_dir={0}'.format(self.work_dir),
+            '--cmd_file={0}'.format(cmd_file),
+            '--key_file={0}'.format(key_file),
+            '--cmd_timeout={0}'.format(500 * self.batch_size),
+            '--log-cli-level=DEBUG',
+            '-o log_cli=true',]
+        if self.stop_on_failure:
+            pytest_args.append('-x')
+        pytest_state = pytest.main(pytest_args)
+        if pytest_state == (pytest.ExitCode.INTERRUPTED or
+                            pytest.ExitCode.TESTS_FAILED):
+            logger.error(
+                'DuT Plugin failed to simulate batches, exiting river_core')
+
+        with open(report_file_name + '_batch.json', 'r') as batch_report:
+            batch_lines = batch_report.read()
+        with open(report_file_name + '.json', 'a') as report:
+            report.write(batch_lines)
+
+    def fold_coverage(self, test):
+        '''
+            Merge the coverage file of a test into the running aggregate of
+            the run
+
+            :param test: name of the test
+
+            :type test: str
+
+            :return: True if the coverage of the test was merged
+
+            :rtype: bool
+        '''
+        if test not in self.test_list:
+            return False
+        cov_file = self.test_list[test]['work_dir'] + '/coverage.dat'
+        if not os.path.isfile(cov_file):
+            return False
+        (root, ext) = os.path.splitext(self.stream_cov_file)
+        if os.path.isfile(self.stream_cov_file):
+            (ret, out, err) = sys_command(
+                'verilator_coverage -write {0}_tmp{1} {0}{1} {2}'.format(
+                    root, ext, cov_file))
+            if ret != 0:
+                return False
+        else:
+            shutil.copyfile(cov_file, root + '_tmp' + ext)
+        os.replace(root + '_tmp' + ext, self.stream_cov_file)
+        return True
+
     @dut_hookimpl
     def post_run(self, test_dict, config):
 
@@ -310,6 +985,10 @@ class chromite_verilator_plugin(object):
                 if test_dict[test]['result'] == 'Passed':
                     logger.debug("Removing extra files for Test: " + str(test))
                     work_dir = test_dict[test]['work_dir']
+                    # The coverage of the test was merged during the run
+                    if self.coverage and self.stream_coverage and \
+                            os.path.isfile(work_dir + '/coverage.dat'):
+                        os.remove(work_dir + '/coverage.dat')
                     try:
                         os.remove(work_dir + '/app_log')
                         os.remove(work_dir + '/code.mem')
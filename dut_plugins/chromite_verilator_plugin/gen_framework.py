@@ -11,30 +11,37 @@ import datetime
 import pytest
 import filecmp
 import glob
+import json
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+import time
 
 from river_core.log import logger
 from river_core.utils import *
 
 
-def compile_cmd_list(make_file, work_dir, key_list):
+def compile_cmd_list(cmd_file, work_dir, key_file):
 
     run_commands = []
 
-    # Hmm here the key_list becomes a string need to do some magic to get into proper list
-    # RE Magic here
-    replacements = {"[": "", "]": "", "'": "", " ": ""}
-    replacements = dict((re.escape(k), v) for k, v in replacements.items())
-    pattern = re.compile("|".join(replacements.keys()))
-    str_key_list = pattern.sub(lambda m: replacements[re.escape(m.group(0))],
-                               key_list)
-    key_list = str_key_list.split(",")
-
-    for file_name in key_list:
-        logger.debug(
-            "Creating Makefile command for {0} to build ASM files".format(
-                file_name))
-        run_commands.append('make -f {0} {1}'.format(
-            make_file, file_name))
+    # The stages of every test are written by the build hook of the plugin
+    with open(cmd_file, 'r') as f:
+        test_commands = json.load(f)
+
+    # The tests to run are listed one per line in key_file
+    with open(key_file, 'r') as keys:
+        for line in keys:
+            file_name = line.strip()
+            if not file_name:
+                continue
+            logger.debug(
+                "Collecting commands for {0}".format(file_name))
+            run_commands.append([file_name,
+                                 test_commands[file_name]['work_dir'],
+                                 test_commands[file_name]['stages']])
     return run_commands
 
 
@@ -48,19 +55,108 @@ def pytest_generate_tests(metafunc):
         logger.debug('Generating commands from pytest_framework')
         test_list = compile_cmd_list(
             # metafunc.config.getoption("output_dir"),
-            metafunc.config.getoption("make_file"),
+            metafunc.config.getoption("cmd_file"),
             metafunc.config.getoption("work_dir"),
-            metafunc.config.getoption("key_list"))
-        metafunc.parametrize('test_input', test_list, ids=idfnc, indirect=True)
+            metafunc.config.getoption("key_file"))
+        metafunc.parametrize('test_input', test_list,
+                             ids=[idfnc(test[0]) for test in test_list],
+                             indirect=True)
+
+
+def run_stage(command, work_dir, timeout):
+    '''
+        Run a stage of a test with sh from work_dir, measuring its runtime
+        and the peak resident set size over the processes of the stage.
+
+        :param command: shell command of the stage
+
+        :param work_dir: directory to run the stage from
+
+        :param timeout: seconds after which the stage is killed
+
+        :type command: str
+
+        :type work_dir: str
+
+        :type timeout: int
+
+        :return: exit code, stdout, stderr and timing record of the stage
+
+        :rtype: tuple
+    '''
+    logger.debug('$ timeout={1} {0} '.format(command, timeout))
+    with tempfile.TemporaryFile() as out_file, \
+            tempfile.TemporaryFile() as err_file:
+        start = time.time()
+        process = subprocess.Popen(['sh', '-c', command],
+                                   cwd=work_dir,
+                                   stdout=out_file,
+                                   stderr=err_file,
+                                   start_new_session=True)
+        # The stage is killed along with its children when it runs for
+        # longer than timeout
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        # The rusage of the shell includes the processes it waited for. As
+        # the forked worker is accounted as well, the RSS of the pytest
+        # worker is a lower bound of the reported peak.
+        pid, status, rusage = os.wait4(process.pid, 0)
+        timer.cancel()
+        end = time.time()
+        # Mark the process as reaped for subprocess
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        out_file.seek(0)
+        err_file.seek(0)
+        out = out_file.read().decode(errors='replace').rstrip()
+        err = err_file.read().decode(errors='replace').rstrip()
+
+    if timed_out.is_set():
+        logger.error('Process Killed')
+        logger.error("Command did not exit within {0} seconds: {1}".format(
+            timeout, command))
+        ret, out, err = 1, "GuruMeditation", "TimeoutExpired"
+    else:
+        ret = process.returncode
+        for text in [out, err]:
+            if text and ret != 0:
+                logger.error(text)
+            elif text:
+                logger.debug(text)
+
+    record = {
+        'start': start,
+        'end': end,
+        'exit': ret,
+        'max_rss_kb': rusage.ru_maxrss
+    }
+    return ret, out, err, record
 
 
 @pytest.fixture
 def test_input(request):
-    # compile tests
+    # run the stages of the test in order, stopping at the first failure
     logger.debug('Generating commands from test_input fixture')
-    program = request.param
-    stage = program.split()[-1]
-    (ret, out, err) = sys_command(program, 500)
+    test, work_dir, stages = request.param
+    timeout = int(request.config.getoption("cmd_timeout"))
+    stage_records = []
+    for stage, command in stages:
+        (ret, out, err, record) = run_stage(command, work_dir, timeout)
+        record['stage'] = stage
+        stage_records.append(record)
+        if ret != 0:
+            break
+    # Stored in the report-log along with the test report
+    request.node.user_properties.append(('stages', stage_records))
     return ret, err, stage
 
 def test_eval(test_input):
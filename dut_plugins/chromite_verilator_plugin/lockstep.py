@@ -0,0 +1,160 @@
+# See LICENSE for details
+'''
+    Run the DUT and spike in lockstep and compare their commit logs while
+    they are being produced.
+
+    Usage: python3 lockstep.py --ignore-lines <N> --dut "<sim command>"
+                --ref "<spike command>"
+
+    The DUT writes its commit log into rtl.dump, which is replaced by a named
+    pipe. Spike is expected to write its commit log to stderr (i.e. run with
+    --log-commits and without --log). The last <N> lines of the DUT log are
+    dropped, as done by "head -n -<N>" in the regular flow.
+
+    Both processes are stopped at the first mismatching line. dut.dump and
+    ref.dump receive the lines compared so far, including the mismatching
+    one, so that the regular dump comparison reports the test as failed.
+    The divergence point is recorded in lockstep.log.
+'''
+
+import argparse
+import collections
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+
+fifo_name = 'rtl.dump'
+log_name = 'lockstep.log'
+queue_depth = 4096
+
+
+def normalise(line):
+    '''
+        Canonical form of a commit log line, matching "diff -iw"
+    '''
+    return ''.join(line.split()).lower()
+
+
+def reader(stream, lines, ref=False):
+    '''
+        Push the lines of a stream into a queue, None marks the end
+
+        :param stream: binary stream to read
+
+        :param lines: queue receiving the decoded lines
+
+        :param ref: only keep the commit lines of spike
+    '''
+    try:
+        for raw in stream:
+            line = raw.decode(errors='replace').rstrip('\n')
+            if ref and not line.startswith('core'):
+                continue
+            lines.put(line)
+    finally:
+        lines.put(None)
+
+
+def dut_reader(fd, lines):
+    '''
+        Read the DUT commit log from the named pipe
+    '''
+    with os.fdopen(fd, 'rb') as stream:
+        reader(stream, lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lockstep DUT/spike compare')
+    parser.add_argument('--dut', required=True, help='simulator command')
+    parser.add_argument('--ref', required=True, help='spike command')
+    parser.add_argument('--ignore-lines', type=int, default=4,
+                        help='trailing DUT lines which are not compared')
+    args = parser.parse_args()
+
+    if os.path.lexists(fifo_name):
+        os.remove(fifo_name)
+    os.mkfifo(fifo_name)
+
+    # Both ends of the named pipe are opened before the DUT starts. The
+    # write end is held until the DUT exits, so that the reader neither
+    # blocks when the DUT never opens the pipe nor sees the end of the log
+    # before the DUT opened it.
+    read_fd = os.open(fifo_name, os.O_RDONLY | os.O_NONBLOCK)
+    hold_fd = os.open(fifo_name, os.O_WRONLY)
+    os.set_blocking(read_fd, True)
+
+    dut_lines = queue.Queue(queue_depth)
+    ref_lines = queue.Queue(queue_depth)
+    dut = subprocess.Popen(shlex.split(args.dut), stdout=subprocess.DEVNULL)
+    ref = subprocess.Popen(shlex.split(args.ref), stdout=subprocess.DEVNULL,
+                           stderr=subprocess.PIPE)
+    threading.Thread(target=dut_reader, args=(read_fd, dut_lines),
+                     daemon=True).start()
+    threading.Thread(target=reader, args=(ref.stderr, ref_lines, True),
+                     daemon=True).start()
+
+    def watch_dut():
+        dut.wait()
+        os.close(hold_fd)
+
+    threading.Thread(target=watch_dut, daemon=True).start()
+
+    # A DUT line is only compared once ignore_lines further lines were seen,
+    # since the trailing lines are dropped.
+    pending = collections.deque()
+    dut_done = False
+    compared = 0
+    divergence = None
+    with open('dut.dump', 'w') as dut_dump, open('ref.dump', 'w') as ref_dump:
+        while True:
+            dut_line = None if dut_done else dut_lines.get()
+            if dut_line is None:
+                dut_done = True
+            else:
+                pending.append(dut_line)
+                if len(pending) <= args.ignore_lines:
+                    continue
+                dut_line = pending.popleft()
+            ref_line = ref_lines.get()
+            if dut_line is None and ref_line is None:
+                break
+            compared += 1
+            if dut_line is not None:
+                dut_dump.write(dut_line + '\n')
+            if ref_line is not None:
+                ref_dump.write(ref_line + '\n')
+            if dut_line is None or ref_line is None or \
+                    normalise(dut_line) != normalise(ref_line):
+                divergence = (compared, dut_line, ref_line)
+                break
+
+    # A DUT which exits on its own with an error still fails the target
+    dut_killed = False
+    if divergence is not None:
+        if dut.poll() is None:
+            dut.kill()
+            dut_killed = True
+        if ref.poll() is None:
+            ref.kill()
+    dut_status = dut.wait()
+    ref.wait()
+    os.remove(fifo_name)
+
+    with open(log_name, 'w') as log:
+        if divergence is None:
+            log.write('Compared {0} lines, no mismatch\n'.format(compared))
+        else:
+            line, dut_line, ref_line = divergence
+            log.write('Mismatch at line {0}\n'.format(line))
+            log.write('DUT: {0}\n'.format(
+                'end of log' if dut_line is None else dut_line))
+            log.write('REF: {0}\n'.format(
+                'end of log' if ref_line is None else ref_line))
+    return 0 if dut_killed else dut_status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,245 @@
+# See LICENSE for details
+'''
+    Scheduling of the tests of a run, shared by the DUT and reference plugins.
+
+    The plugin directories are not packages, so every plugin keeps an
+    identical copy of this file next to it and loads it by path. A change
+    has to be made to all the copies.
+'''
+
+import fnmatch
+import glob
+import json
+import os
+import re
+import shutil
+
+import pytest
+
+from river_core.log import logger
+from river_core.utils import load_yaml
+
+
+def order_tests(test_names, test_list, history_file):
+    '''
+        Function to order the tests longest expected runtime first, so that
+        long tests do not end up alone at the tail of the run.
+
+        Tests without a recorded runtime are estimated from the size of their
+        asm file, scaled by the median runtime per byte of the tests with a
+        recorded runtime.
+
+        :param test_names: names of the tests to order
+
+        :param test_list: test list of the run
+
+        :param history_file: JSON file with the runtime of each test
+
+        :type test_names: list
+
+        :type test_list: dict
+
+        :type history_file: str
+
+        :return: ordered test names
+
+        :rtype: list
+    '''
+    history = {}
+    if os.path.isfile(history_file):
+        with open(history_file, 'r') as f:
+            history = json.load(f)
+
+    asm_size = {}
+    for test in test_names:
+        try:
+            asm_size[test] = os.path.getsize(test_list[test]['asm_file'])
+        except (KeyError, OSError):
+            asm_size[test] = 0
+
+    rates = sorted(history[test] / asm_size[test]
+                   for test in test_names
+                   if test in history and asm_size[test])
+    rate = rates[len(rates) // 2] if rates else 1.0
+    expected = {}
+    for test in test_names:
+        if test in history:
+            expected[test] = history[test]
+        else:
+            expected[test] = asm_size[test] * rate
+    return sorted(test_names, key=lambda test: expected[test], reverse=True)
+
+
+def record_durations(report_file, history_file, test_list):
+    '''
+        Function to store the runtime of the tests of a pytest report-log in
+        the history file
+
+        :param report_file: report-log JSON of the run
+
+        :param history_file: JSON file with the runtime of each test
+
+        :param test_list: test list of the run
+
+        :type report_file: str
+
+        :type history_file: str
+
+        :type test_list: dict
+    '''
+    if not os.path.isfile(report_file):
+        return
+    history = {}
+    if os.path.isfile(history_file):
+        with open(history_file, 'r') as f:
+            history = json.load(f)
+    with open(report_file, 'r') as report:
+        for line in report:
+            entry = json.loads(line)
+            if entry.get('$report_type', None) != 'TestReport' or \
+                    entry['when'] != 'call':
+                continue
+            test = entry['nodeid'].rsplit('[', 1)[-1][:-1]
+            if test in test_list:
+                history[test] = entry['duration']
+    with open(history_file + '.tmp', 'w') as f:
+        json.dump(history, f)
+    os.replace(history_file + '.tmp', history_file)
+
+
+def priority_tests(test_names, json_dir, name, failed_list, smoke):
+    '''
+        Function to pick the tests run ahead of the regression: the tests
+        which failed in the previous run, followed by the smoke tests.
+
+        The previous failures are the tests reported as failed in the latest
+        report-log of the plugin and the tests of the failed list written by
+        river_core after comparing the dumps. river_core does not remove the
+        failed list of an earlier run when a later run passes, so it is only
+        used when it was written after the latest report-log.
+
+        :param test_names: names of the tests of the run, in dispatch order
+
+        :param json_dir: directory of the report-logs
+
+        :param name: name of the plugin, prefix of its report-logs
+
+        :param failed_list: YAML file with the failed tests of the last run
+
+        :param smoke: fnmatch patterns of the smoke tests
+
+        :type test_names: list
+
+        :type json_dir: str
+
+        :type name: str
+
+        :type failed_list: str
+
+        :type smoke: list
+
+        :return: names of the priority tests
+
+        :rtype: list
+    '''
+    failed = set()
+    report_re = re.compile(re.escape(name) + r'_\d{8}-\d{4}\.json$')
+    reports = [
+        x for x in glob.glob(os.path.join(json_dir, name + '_*.json'))
+        if report_re.match(os.path.basename(x))
+    ]
+    if reports:
+        latest = max(reports, key=os.path.getmtime)
+        with open(latest, 'r') as report:
+            for line in report:
+                entry = json.loads(line)
+                if entry.get('$report_type', None) == 'TestReport' and \
+                        entry['outcome'] == 'failed':
+                    failed.add(entry['nodeid'].rsplit('[', 1)[-1][:-1])
+        if os.path.isfile(failed_list) and \
+                os.path.getmtime(failed_list) >= os.path.getmtime(latest):
+            failed.update(load_yaml(failed_list) or {})
+
+    priority = [test for test in test_names if test in failed]
+    priority += [
+        test for test in test_names if test not in failed and
+        any(fnmatch.fnmatch(test, pattern) for pattern in smoke)
+    ]
+    return priority
+
+
+def run_priority_first(pytest_args, report_file_name, key_file, test_names,
+                       priority, plugins=None):
+    '''
+        Function to run the tests in two pytest sessions, the priority tests
+        in the first one so that their results are available before the rest
+        of the regression is dispatched. The report-log of the first session
+        is merged into the report-log of the run.
+
+        :param pytest_args: arguments of the pytest session of the run
+
+        :param report_file_name: report-log of the run without the .json
+            extension
+
+        :param key_file: manifest of the tests to run
+
+        :param test_names: names of the tests of the run, in dispatch order
+
+        :param priority: names of the tests to run first
+
+        :param plugins: pytest plugin objects of the sessions
+
+        :type pytest_args: list
+
+        :type report_file_name: str
+
+        :type key_file: str
+
+        :type test_names: list
+
+        :type priority: list
+
+        :type plugins: list
+
+        :return: exit code of the last pytest session
+
+        :rtype: int
+    '''
+    if not priority:
+        return pytest.main(pytest_args, plugins=plugins)
+
+    priority_report = report_file_name + '_priority'
+    priority_args = []
+    for arg in pytest_args:
+        if arg.startswith('--report-log='):
+            arg = '--report-log={0}.json'.format(priority_report)
+        elif arg.startswith('--html='):
+            arg = arg[:-len('.html')] + '_priority.html'
+        priority_args.append(arg)
+    with open(key_file, 'w') as keys:
+        keys.write(''.join(test + '\n' for test in priority))
+    logger.info('Running {0} previously failing and smoke tests first'.format(
+        len(priority)))
+    pytest_state = pytest.main(priority_args, plugins=plugins)
+
+    priority_set = set(priority)
+    rest = [test for test in test_names if test not in priority_set]
+    if '-x' in pytest_args and pytest_state == pytest.ExitCode.TESTS_FAILED:
+        logger.error('Priority tests failed, skipping the other tests')
+        rest = []
+    with open(key_file, 'w') as keys:
+        keys.write(''.join(test + '\n' for test in rest))
+    if rest:
+        pytest_state = pytest.main(pytest_args, plugins=plugins)
+
+    with open(report_file_name + '.json.tmp', 'w') as merged:
+        for part in [priority_report + '.json', report_file_name + '.json']:
+            if os.path.isfile(part):
+                with open(part, 'r') as report:
+                    shutil.copyfileobj(report, merged)
+    os.replace(report_file_name + '.json.tmp', report_file_name + '.json')
+    if os.path.isfile(priority_report + '.json'):
+        os.remove(priority_report + '.json')
+    with open(key_file, 'w') as keys:
+        keys.write(''.join(test + '\n' for test in priority + rest))
+    return pytest_state
@@ -3,6 +3,15 @@
 #include <verilated.h>
 
 #include <verilated_vcd_c.h>
+#include <verilated_syms.h>
+
+#include <cstring>
+#include <fstream>
+#include <iostream>
+#include <sstream>
+#include <string>
+#include <vector>
+#include <unistd.h>
 
 #include "sim_main.h"
 
@@ -12,22 +21,45 @@ double sc_time_stamp () {    // Called by $time in Verilog
     return main_time;
 }
 
-int main (int argc, char **argv, char **env) {
-    
-    // Prevent unused variable warnings
-    if (0 && argc && argv && env) {}
-
-    Verilated::commandArgs (argc, argv);    // remember args
-    
-    // Set debug level, 0 is off, 9 is highest presently used
-    Verilated::debug(0);
+// Sparse memory images (+sparsemem=<variable>) only hold the populated words
+// of the memory. The memory, the only public variable of that name (see
+// sparse_mem.vlt), is zeroed after the model is constructed and before its
+// initial blocks load the image. The rest of the model keeps the randomized
+// reset.
+static void clear_sparse_mem (const char* name) {
+    int cleared = 0;
+    const VerilatedScopeNameMap* scopes =
+        Verilated::threadContextp()->scopeNameMap();
+    if (scopes) {
+        for (const auto& scope : *scopes) {
+            VerilatedVarNameMap* vars = scope.second->varsp();
+            if (!vars) continue;
+            for (auto& var : *vars) {
+                if (strcmp(var.first, name)) continue;
+                memset(var.second.datap(), 0, var.second.totalSize());
+                cleared++;
+            }
+        }
+    }
+    if (!cleared) {
+        fprintf(stderr, "No public memory %s to clear for +sparsemem\n", name);
+    }
+}
 
-    // Randomization reset policy
-    Verilated::randReset(2);
+// Construct the model, simulate it until $finish and tear it down again.
+// Files opened by the model are relative to the current directory.
+static void simulate () {
 
+    main_time = 0;
+    Verilated::gotFinish(false);
 
     TOPMODULE* top = new TOPMODULE;    // create instance of model
 
+    const char* sparse = Verilated::commandArgsPlusMatch("sparsemem=");
+    if (sparse && 0==strncmp(sparse, "+sparsemem=", 11)) {
+        clear_sparse_mem(sparse + 11);
+    }
+
 #if VM_TRACE
     // If verilator was invoked with --trace argument,
     // and if at run time passed the +trace argument, turn on tracing
@@ -78,6 +110,94 @@ int main (int argc, char **argv, char **env) {
 #endif
     delete top;
     top = NULL;
+#if VM_COVERAGE
+    // The next model registers its coverage points again
+    VerilatedCov::clear();
+#endif
+
+    // Files opened by the model with $fopen are not closed on deletion, they
+    // stay open until the process exits. The plugin caps batch_size so that
+    // a batch stays within RLIMIT_NOFILE.
+    fflush(NULL);
+}
+
+// Batch mode: +batch=<list> runs one test per line of the list (or of stdin
+// when the list is "-"). Each line holds the work directory of the test
+// followed by optional plusargs for that test only. The remaining arguments
+// of the process are passed to every test.
+static int simulate_batch (int argc, char **argv, const std::string &list) {
+
+    std::vector<std::string> common;
+    for (int i = 0; i < argc; i++) {
+        if (strncmp(argv[i], "+batch=", 7)) common.push_back(argv[i]);
+    }
+
+    std::ifstream file;
+    std::istream* in = &std::cin;
+    if (list != "-") {
+        file.open(list);
+        if (!file) {
+            fprintf(stderr, "Cannot open batch list %s\n", list.c_str());
+            return 1;
+        }
+        in = &file;
+    }
+
+    char cwd[4096];
+    if (!getcwd(cwd, sizeof(cwd))) {
+        perror("getcwd");
+        return 1;
+    }
+
+    int status = 0;
+    std::string line;
+    while (std::getline(*in, line)) {
+        std::istringstream fields(line);
+        std::string dir;
+        if (!(fields >> dir)) continue;
+
+        std::vector<std::string> args(common);
+        std::string arg;
+        while (fields >> arg) args.push_back(arg);
+        std::vector<const char*> test_argv;
+        for (size_t i = 0; i < args.size(); i++) {
+            test_argv.push_back(args[i].c_str());
+        }
+
+        if (chdir(dir.c_str())) {
+            fprintf(stderr, "Cannot enter test directory %s\n", dir.c_str());
+            status = 1;
+            continue;
+        }
+        Verilated::commandArgs (test_argv.size(), test_argv.data());
+        simulate();
+        if (chdir(cwd)) {
+            perror("chdir");
+            return 1;
+        }
+    }
+    return status;
+}
+
+int main (int argc, char **argv, char **env) {
+
+    // Prevent unused variable warnings
+    if (0 && argc && argv && env) {}
+
+    Verilated::commandArgs (argc, argv);    // remember args
+
+    // Set debug level, 0 is off, 9 is highest presently used
+    Verilated::debug(0);
+
+    // Randomization reset policy
+    Verilated::randReset(2);
+
+    const char* batch = Verilated::commandArgsPlusMatch("batch");
+    if (batch && 0==strncmp(batch, "+batch=", 7)) {
+        exit (simulate_batch(argc, argv, std::string(batch + 7)));
+    }
+
+    simulate();
 
     exit (0);
 }
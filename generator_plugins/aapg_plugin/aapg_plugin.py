@@ -11,6 +11,7 @@ import re
 import datetime
 import pytest
 import glob
+import json
 from river_core.log import logger
 import river_core.utils as utils
 from river_core.constants import *
@@ -19,6 +20,50 @@ import re
 gen_hookimpl = pluggy.HookimplMarker("generator")
 
 
+def read_header(path):
+    '''
+        Read the comment lines heading an ASM file
+
+        :param path: path of the ASM file
+
+        :type path: str
+
+        :return: lines up to the first line of code
+
+        :rtype: list
+    '''
+    header = []
+    with open(path, 'r') as asm_file:
+        for line in asm_file:
+            if line.strip() and not line.startswith('#'):
+                break
+            header.append(line)
+    return header
+
+
+def load_manifests(manifest_dir):
+    '''
+        Merge the manifests written by the generation workers
+
+        :param manifest_dir: directory holding the <worker>.jsonl manifests
+
+        :type manifest_dir: str
+
+        :return: rel_ header lines of every generated test, keyed by the
+            path of its ASM file
+
+        :rtype: dict
+    '''
+    tests = {}
+    for manifest in sorted(glob.glob(manifest_dir + '/*.jsonl')):
+        with open(manifest, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    tests[entry['asm_file']] = entry['rel']
+    return tests
+
+
 class aapg_plugin(object):
     """ Generator hook implementation """
 
@@ -101,11 +146,20 @@ class aapg_plugin(object):
         # Get the aapg dir from output
         asm_dir = output_dir + '/aapg/asm/'
         test_list = {}
-        asm_test_list = glob.glob(asm_dir + '**/*[!_template].S')
+        # The workers list the tests they generated along with the rel_
+        # lines of their headers. Without manifests, only the headers of the
+        # ASM files are read.
+        manifest = load_manifests(output_dir + '/aapg/manifest')
+        if manifest:
+            asm_test_list = list(manifest)
+        else:
+            asm_test_list = glob.glob(asm_dir + '**/*[!_template].S')
         # asm_templates = glob.glob(asm_dir+'/**/*.S')
         for test in asm_test_list:
-            with open(test, 'r') as file:
-                test_asm = file.read()
+            if test in manifest:
+                test_asm = ''.join(manifest[test])
+            else:
+                test_asm = ''.join(read_header(test))
             isa = set()
             isa.add('i')
             xlen = 64 if '64' in self.isa else '32'
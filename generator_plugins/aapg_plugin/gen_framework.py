@@ -10,6 +10,7 @@ from river_core.constants import *
 import random
 import re
 import datetime
+import json
 import pytest
 from envyaml import EnvYAML
 
@@ -24,12 +25,16 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
     dirname = output_dir + '/aapg'
     utils.sys_command('aapg setup --setup_dir {0}'.format(dirname))
     setup_dir = dirname
+    # With in_process, the tests of a config are generated by calling aapg
+    # from the worker instead of starting "aapg gen" for every test
+    in_process = gen_list.get('in_process', False)
 
     for key, value in gen_list.items():
         if key == 'configs':
             for configs in gen_list[key]:
                 template_name = os.path.basename(configs)
                 config_file = os.path.abspath(configs)
+                tests = []
                 for i in range(int(count)):
                     if seed == 'random':
                         gen_seed = random.randint(0, 10000)
@@ -42,6 +47,9 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
                     test_prefix = 'aapg_{0}_{1}_{2:05}'.format(
                         template_name.replace('.yaml', ''), gen_prefix, i)
                     testdir = '{0}/asm/{1}'.format(dirname, test_prefix)
+                    if in_process:
+                        tests.append((testdir, test_prefix, gen_seed))
+                        continue
                     run_command.append('aapg gen \
                                         --config_file {0} \
                                         --setup_dir {1} \
@@ -51,11 +59,106 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
                                         '.format(config_file, setup_dir,
                                                  testdir, test_prefix,
                                                  gen_seed))
+                if tests:
+                    run_command.append((config_file, setup_dir, tests))
 
     return run_command
 
 
+def read_header(path):
+    '''
+        Read the comment lines heading an ASM file
+
+        :param path: path of the ASM file
+
+        :type path: str
+
+        :return: lines up to the first line of code
+
+        :rtype: list
+    '''
+    header = []
+    with open(path, 'r') as asm_file:
+        for line in asm_file:
+            if line.strip() and not line.startswith('#'):
+                break
+            header.append(line)
+    return header
+
+
+def record_test(dirname, asm_file):
+    '''
+        Add a generated test to the manifest of this worker, so that gen()
+        does not need to read the ASM file again. The manifest holds one
+        JSON object per line with the path of the ASM file and the rel_
+        lines of its header.
+
+        :param dirname: aapg output directory
+
+        :param asm_file: path of the generated ASM file
+
+        :type dirname: str
+
+        :type asm_file: str
+    '''
+    entry = {
+        'asm_file': asm_file,
+        'rel': [x for x in read_header(asm_file) if re.match(r'#\s*rel_', x)]
+    }
+    manifest_dir = dirname + '/manifest'
+    os.makedirs(manifest_dir, exist_ok=True)
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'master')
+    with open('{0}/{1}.jsonl'.format(manifest_dir, worker), 'a') as manifest:
+        manifest.write(json.dumps(entry) + '\n')
+
+
+def gen_in_process(config_file, setup_dir, tests):
+    '''
+        Generate tests of a config by calling aapg directly, the same way as
+        "aapg gen --num_programs 1" does for each of them
+
+        :param config_file: path of the aapg config YAML
+
+        :param setup_dir: directory set up by "aapg setup"
+
+        :param tests: list of (output dir, asm name, seed) tuples
+
+        :type config_file: str
+
+        :type setup_dir: str
+
+        :type tests: list
+
+        :return: number of tests which could not be generated
+
+        :rtype: int
+    '''
+    import aapg.main
+    import aapg.gen_random_program as gen_random_program
+
+    failed = 0
+    for testdir, test_prefix, gen_seed in tests:
+        # aapg keeps the registers reserved by a test in a module global,
+        # which is fresh in every "aapg gen" process
+        del gen_random_program.no_use_regs[:]
+        args = aapg.main.myClass(1, config_file, test_prefix, setup_dir,
+                                 testdir, 'rv64', str(gen_seed), False, True,
+                                 False, False)
+        try:
+            args.seed = gen_random_program.gen_config_files(args)
+            args.seed = int(args.seed)
+            gen_random_program.run(args, 0)
+            record_test(os.path.dirname(os.path.dirname(testdir)),
+                        '{0}/{1}.S'.format(testdir, test_prefix))
+        except (Exception, SystemExit) as e:
+            logger.error('aapg failed on {0}: {1}'.format(test_prefix, e))
+            failed += 1
+    return failed
+
+
 def idfnc(val):
+    if isinstance(val, tuple):
+        return 'Generating {0}'.format(val[0].replace('.yaml', ''))
     template_match = re.search('--config_file (.*).yaml', '{0}'.format(val))
     logger.debug('{0}'.format(val))
     return 'Generating {0}'.format(template_match.group(1))
@@ -75,11 +178,22 @@ def pytest_generate_tests(metafunc):
 def test_input(request, autouse=True):
     # compile tests
     program = request.param
+    if isinstance(program, tuple):
+        (config_file, setup_dir, tests) = program
+        if not os.path.isfile(config_file):
+            logger.error('File not found {0}'.format(config_file))
+            return 1
+        return gen_in_process(config_file, setup_dir, tests)
     template_match = re.search('--config_file (.*).yaml', program)
     #sys_command(program)
     #return 0
     if os.path.isfile('{0}.yaml'.format(template_match.group(1))):
         (ret, out, err) = utils.sys_command(program)
+        if ret == 0:
+            testdir = re.search('--output_dir (\\S+)', program).group(1)
+            test_prefix = re.search('--asm_name (\\S+)', program).group(1)
+            record_test(os.path.dirname(os.path.dirname(testdir)),
+                        '{0}/{1}.S'.format(testdir, test_prefix))
         return ret
     else:
         logger.error('File not found {0}'.format(template_match.group(1)))
@@ -0,0 +1,67 @@
+// See LICENSE for details
+
+import java.io.BufferedReader;
+import java.io.FileReader;
+import java.io.IOException;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+
+/**
+ * Run MicroTESK for several tests in a single JVM.
+ *
+ * Usage: java -cp <MicroTESK classpath> MicroTeskBatch.java <main class> <list>
+ *
+ * Every line of the list holds the arguments of one MicroTESK run, as given
+ * to bin/generate.sh. The static run(String...) method of the main class is
+ * called for every line, so that the JVM and MicroTESK are started once for
+ * all of them. The exit status is 1 when a test could not be generated.
+ */
+public class MicroTeskBatch {
+
+    public static void main(String[] args) throws Exception {
+        if (args.length != 2) {
+            System.err.println("Usage: MicroTeskBatch <main class> <list>");
+            System.exit(2);
+        }
+
+        Method run;
+        try {
+            run = Class.forName(args[0]).getMethod("run", String[].class);
+        } catch (ClassNotFoundException | NoSuchMethodException e) {
+            System.err.println("No run(String...) method in " + args[0] +
+                               ": " + e);
+            System.exit(2);
+            return;
+        }
+
+        int failed = 0;
+        try (BufferedReader list = new BufferedReader(new FileReader(args[1]))) {
+            String line;
+            while ((line = list.readLine()) != null) {
+                line = line.trim();
+                if (line.isEmpty()) {
+                    continue;
+                }
+                if (!generateTest(run, line.split("\\s+"))) {
+                    System.err.println("Failed: " + line);
+                    failed++;
+                }
+            }
+        } catch (IOException e) {
+            System.err.println("Cannot read " + args[1] + ": " + e);
+            System.exit(2);
+        }
+        System.exit(failed == 0 ? 0 : 1);
+    }
+
+    private static boolean generateTest(Method run, String[] args) {
+        try {
+            Object result = run.invoke(null, (Object) args);
+            return !Boolean.FALSE.equals(result);
+        } catch (InvocationTargetException | IllegalAccessException e) {
+            Throwable cause = e.getCause() != null ? e.getCause() : e;
+            System.err.println(cause);
+            return false;
+        }
+    }
+}
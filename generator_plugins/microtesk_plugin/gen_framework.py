@@ -10,6 +10,8 @@ from river_core.constants import *
 import random
 import re
 import datetime
+import glob
+import json
 import pytest
 from envyaml import EnvYAML
 
@@ -28,12 +30,28 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
 
     gen_list = utils.load_yaml(gen_config)
     gen_list['global_home'] = env_gen_list['global_home']
+    if 'global_classpath' in gen_list:
+        gen_list['global_classpath'] = env_gen_list['global_classpath']
     ## schema validator should be here
     out = ''
     command = ''
     config_path = ''
     args = ''
     run_command = []
+    # With global_batch, all the tests of a template are generated by a
+    # single JVM calling MicroTESK once per test, instead of starting
+    # generate.sh for every test
+    batch = gen_list.get('global_batch', False)
+    if batch:
+        model = ' '.join(gen_list['global_command'].split()[1:])
+        main_class = gen_list.get('global_main_class',
+                                  'ru.ispras.microtesk.MicroTESK')
+        classpath = gen_list.get('global_classpath',
+                                 '{0}/lib/jars/*'.format(
+                                     gen_list['global_home']))
+        batch_command = 'java -cp {0} {1} {2}'.format(
+            classpath, os.path.join(module_dir, 'microtesk_plugin',
+                                    'MicroTeskBatch.java'), main_class)
     for key, value in gen_list.items():
         if key == 'global_config_path':
             ## Here's the moduledir being used, earlier code a value from constant being loaded
@@ -52,6 +70,7 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
             logger.debug(config_file)
             template_name = os.path.basename(config_file)
 
+            batch_lines = []
             for i in range(int(count)):
                 if seed == 'random':
                     gen_seed = random.randint(0, 1000000)
@@ -64,6 +83,13 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
                 test_prefix = 'microtesk_{0}_{1}_{2:05}'.format(
                     template_name.replace('.rb', ''), gen_prefix, i)
                 testdir = '{0}/asm/{1}'.format(dirname, test_prefix)
+                if batch:
+                    batch_lines.append(
+                        '{0} {1} {2} --code-file-extension S --output-dir {3} '
+                        '--code-file-prefix {4} --rs {5} -g\n'.format(
+                            args, model, config_file, testdir, test_prefix,
+                            gen_seed))
+                    continue
                 run_command.append('{0} {1} \
                                     --code-file-extension S \
                                     --output-dir {2} \
@@ -72,12 +98,72 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
                                     '.format(command, config_file, testdir,
                                              test_prefix, gen_seed))
 
+            if batch and batch_lines:
+                os.makedirs(dirname + '/batch', exist_ok=True)
+                list_file = '{0}/batch/{1}.list'.format(
+                    dirname, template_name.replace('.rb', ''))
+                with open(list_file, 'w') as batch_list:
+                    batch_list.writelines(batch_lines)
+                run_command.append('{0} {1}'.format(batch_command, list_file))
+
     return run_command
 
 
+def read_header(path):
+    '''
+        Read the comment lines heading an ASM file
+
+        :param path: path of the ASM file
+
+        :type path: str
+
+        :return: lines up to the first line of code
+
+        :rtype: list
+    '''
+    header = []
+    with open(path, 'r') as asm_file:
+        for line in asm_file:
+            if line.strip() and not line.startswith('#'):
+                break
+            header.append(line)
+    return header
+
+
+def record_tests(testdirs):
+    '''
+        Add the tests generated in testdirs to the manifest of this worker,
+        so that gen() does not need to read the ASM files again. The
+        manifest holds one JSON object per line with the path of the ASM
+        file and the rel_ lines of its header.
+
+        :param testdirs: output directories given to microtesk
+
+        :type testdirs: list
+    '''
+    if not testdirs:
+        return
+    manifest_dir = os.path.dirname(os.path.dirname(testdirs[0])) + '/manifest'
+    os.makedirs(manifest_dir, exist_ok=True)
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'master')
+    with open('{0}/{1}.jsonl'.format(manifest_dir, worker), 'a') as manifest:
+        for testdir in testdirs:
+            for asm_file in sorted(glob.glob(testdir + '/*.S')):
+                entry = {
+                    'asm_file': asm_file,
+                    'rel': [
+                        x for x in read_header(asm_file)
+                        if re.match(r'#\s*rel_', x)
+                    ]
+                }
+                manifest.write(json.dumps(entry) + '\n')
+
+
 def idfnc(val):
     template_match = re.search('riscv (.*).rb', '{0}'.format(val))
     logger.debug('{0}'.format(val))
+    if template_match is None:
+        template_match = re.search('/batch/(.*).list', '{0}'.format(val))
     return 'Generating {0}'.format(template_match.group(1))
 
 
@@ -95,9 +181,25 @@ def pytest_generate_tests(metafunc):
 def test_input(request, autouse=True):
     # compile tests
     program = request.param
+    batch_match = re.search(' (\\S*/batch/.*.list)$', program)
+    if batch_match:
+        # Every test of the batch is given the time of a single run
+        with open(batch_match.group(1), 'r') as batch_list:
+            tests = batch_list.read().splitlines()
+        template_match = re.search('riscv (.*).rb', tests[0])
+        if os.path.isfile('{0}.rb'.format(template_match.group(1))):
+            (ret, out, err) = utils.sys_command(program,
+                                                timeout=240 * len(tests))
+            record_tests(
+                [re.search('--output-dir (\\S+)', x).group(1) for x in tests])
+            return ret
+        logger.error('File not found {0}'.format(template_match.group(1)))
+        return 1
     template_match = re.search('riscv (.*).rb', program)
     if os.path.isfile('{0}.rb'.format(template_match.group(1))):
         (ret, out, err) = utils.sys_command(program)
+        if ret == 0:
+            record_tests([re.search('--output-dir (\\S+)', program).group(1)])
         return ret
     else:
         logger.error('File not found {0}'.format(template_match.group(1)))
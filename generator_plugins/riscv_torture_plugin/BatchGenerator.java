@@ -0,0 +1,70 @@
+// See LICENSE for details
+
+import java.io.BufferedReader;
+import java.io.FileReader;
+import java.io.IOException;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+
+/**
+ * Generate several riscv-torture tests in a single JVM.
+ *
+ * Usage: java -cp <generator classpath> BatchGenerator.java <list>
+ *
+ * Every line of the list holds a config file and the output name of one
+ * test, as given to "generator/run --config <config> --output <output>".
+ * The tests are written below output/ of the current directory. A test is
+ * tried up to three times. The exit status is 1 when a test could not be
+ * generated.
+ */
+public class BatchGenerator {
+
+    private static final int ATTEMPTS = 3;
+
+    public static void main(String[] args) throws Exception {
+        if (args.length != 1) {
+            System.err.println("Usage: BatchGenerator <list>");
+            System.exit(2);
+        }
+
+        // The generator is a Scala object, reached through its module
+        Class<?> generatorClass = Class.forName("torture.generator.Generator$");
+        Object generator = generatorClass.getField("MODULE$").get(null);
+        Method generate = generatorClass.getMethod("generate", String.class,
+                                                   String.class);
+
+        int failed = 0;
+        try (BufferedReader list = new BufferedReader(new FileReader(args[0]))) {
+            String line;
+            while ((line = list.readLine()) != null) {
+                String[] fields = line.trim().split("\\s+", 2);
+                if (fields.length != 2) {
+                    continue;
+                }
+                if (!generateTest(generator, generate, fields[0], fields[1])) {
+                    failed++;
+                }
+            }
+        } catch (IOException e) {
+            System.err.println("Cannot read " + args[0] + ": " + e);
+            System.exit(2);
+        }
+        System.exit(failed == 0 ? 0 : 1);
+    }
+
+    private static boolean generateTest(Object generator, Method generate,
+                                        String config, String output) {
+        for (int attempt = 1; attempt <= ATTEMPTS; attempt++) {
+            try {
+                generate.invoke(generator, config, output);
+                System.out.println("Generated " + output + " from " + config);
+                return true;
+            } catch (InvocationTargetException | IllegalAccessException e) {
+                Throwable cause = e.getCause() != null ? e.getCause() : e;
+                System.err.println("Attempt " + attempt + " for " + output +
+                                   " failed: " + cause);
+            }
+        }
+        return false;
+    }
+}
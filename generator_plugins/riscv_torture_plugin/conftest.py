@@ -12,3 +12,7 @@ def pytest_addoption(parser):
 
     parser.addoption("--module_dir", action="store")
 
+    parser.addoption("--jobs", action="store", default=1)
+
+    parser.addoption("--classpath", action="store", default=None)
+
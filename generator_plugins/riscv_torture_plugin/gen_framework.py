@@ -64,13 +64,15 @@ def sys_command(command, cwd=None, timeout=3000):
     return (process.returncode, out.decode("ascii"), err.decode("ascii"))
 
 
-def gen_cmd_list(configlist, seed, count, output_dir, module_dir):
+def gen_cmd_list(configlist, seed, count, output_dir, module_dir, jobs=1,
+                 classpath=None):
     logger.debug(f"Now generating commands for riscv-torture {configlist}")
     pwd = os.getcwd()
     exec_dir = f"{output_dir}"
     torture_command = f"java -Xmx1G -Xss8M -jar sbt-launch.jar"
 
     run_command = []
+    tests = []
     config_yaml = utils.load_yaml(configlist)
     for c in config_yaml['configs']:
         name = c.split('/')[-1].replace('.','_')
@@ -78,13 +80,34 @@ def gen_cmd_list(configlist, seed, count, output_dir, module_dir):
         for i in range(config_yaml['configs'][c]):
             logger.debug(i)
             os.makedirs(f'{exec_dir}/output/{name}_{i}/', exist_ok = True)
-            run_command.append((f"{torture_command} \'generator/run --config {config_path} --output {name}_{i}/test\'", exec_dir))
+            tests.append((config_path, f'{name}_{i}/test'))
+
+    if classpath:
+        # The tests are shared among a pool of JVMs running the generator
+        # directly, instead of starting sbt for every test. BatchGenerator
+        # retries the failing tests itself.
+        batch_command = 'java -Xmx1G -Xss8M -cp {0} {1}'.format(
+            classpath,
+            os.path.join(module_dir, 'riscv_torture_plugin',
+                         'BatchGenerator.java'))
+        jobs = max(1, min(int(jobs), len(tests)))
+        for k in range(jobs):
+            list_file = f'{exec_dir}/batch_{k}.list'
+            with open(list_file, 'w') as batch_list:
+                for config_path, output in tests[k::jobs]:
+                    batch_list.write(f'{config_path} {output}\n')
+            run_command.append((f'{batch_command} {list_file}', exec_dir, 0))
+    else:
+        for config_path, output in tests:
+            run_command.append((f"{torture_command} \'generator/run --config {config_path} --output {output}\'", exec_dir, 3))
     logger.debug(run_command)
     return run_command
 
 def idfnc(val):
     template_match = re.search('--config (.*).config', '{0}'.format(val))
     logger.debug('{0}'.format(val))
+    if template_match is None:
+        template_match = re.search('/(batch_[0-9]+).list', '{0}'.format(val))
     return 'Generating {0}'.format(template_match.group(1))
 
 
@@ -94,16 +117,18 @@ def pytest_generate_tests(metafunc):
                                  metafunc.config.getoption("seed"),
                                  metafunc.config.getoption("count"),
                                  metafunc.config.getoption("output_dir"),
-                                 metafunc.config.getoption("module_dir"))
+                                 metafunc.config.getoption("module_dir"),
+                                 metafunc.config.getoption("jobs"),
+                                 metafunc.config.getoption("classpath"))
         metafunc.parametrize('test_input', test_list, ids=idfnc, indirect=True)
 
 
 @pytest.fixture
 def test_input(request, autouse=True):
     # compile tests
-    (program, exec_dir) = request.param
+    (program, exec_dir, retries) = request.param
     (ret, out, err) = sys_command(program, cwd=exec_dir)
-    for x in range(3):
+    for x in range(retries):
         if ret != 0 :
             (ret, out, err) = sys_command(program, cwd=exec_dir)
         else:
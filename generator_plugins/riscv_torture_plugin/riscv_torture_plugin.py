@@ -55,6 +55,28 @@ class riscv_torture_plugin(object):
             subprocess.call(shlex.split(f"rm -f output/*"))
             os.chdir(cwd)
 
+        # With batch, the tests are generated by a pool of JVMs running the
+        # generator directly instead of starting sbt for every test. The
+        # classpath is the generator_jar, else it is asked from sbt once.
+        config_yaml = utils.load_yaml(self.configs)
+        self.classpath = None
+        if config_yaml.get('batch', False):
+            if 'generator_jar' in config_yaml:
+                self.classpath = os.path.abspath(config_yaml['generator_jar'])
+            else:
+                result = subprocess.run(shlex.split(
+                    "java -Xmx1G -Xss8M -jar sbt-launch.jar "
+                    "'export generator/runtime:fullClasspath'"),
+                                        cwd=f'{self.output_dir}/riscv-torture',
+                                        capture_output=True, text=True)
+                lines = result.stdout.strip().splitlines()
+                if result.returncode == 0 and lines:
+                    self.classpath = lines[-1].strip()
+            if not self.classpath:
+                logger.error('Could not get the classpath of the generator')
+                raise SystemExit(1)
+            logger.debug(f'Generator classpath: {self.classpath}')
+
         self.isa = spec_config['isa']
         self.json_dir = output_dir + '/../.json'
         if (os.path.isdir(self.json_dir)):
@@ -92,8 +114,10 @@ class riscv_torture_plugin(object):
             '--report-log={0}.json'.format(report_file_name),
             '--self-contained-html', 
             '--output_dir={0}'.format(f'{self.output_dir}/riscv-torture/'),
-            '--module_dir={0}'.format(module_dir)
-        ])
+            '--module_dir={0}'.format(module_dir),
+            '--jobs={0}'.format(self.jobs)
+        ] + (['--classpath={0}'.format(self.classpath)]
+             if self.classpath else []))
         asm_dir = self.output_dir + '/riscv-torture/output/'
         test_list = {}
         asm_test_list = glob.glob(asm_dir + '**/*.S')
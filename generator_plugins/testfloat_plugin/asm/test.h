@@ -33,3 +33,31 @@
     inst destreg, reg1;\
     csrrs x2, fflags, x0;   \
 
+
+// Self-checking tests (RV64 only). fflags is cleared before the operation so
+// that x2 only holds its flags. The result (moved to x30 for FP results) and
+// x2 are compared with the expected result and flags at offset(x3). On a
+// mismatch x29 holds the number of the failing case.
+#define TEST_CLEAR_FLAGS \
+    csrrw x0, fflags, x0;
+
+#define TEST_CHECK(resreg, testnum, offset) \
+    li x29, testnum; \
+    ld x31, offset(x3); \
+    bne resreg, x31, 1f; \
+    ld x31, offset+8(x3); \
+    beq x2, x31, 2f; \
+1:  auipc x31, %pcrel_hi(rvtest_fail); \
+    jalr x0, %pcrel_lo(1b)(x31); \
+2:
+
+#define TEST_CHECK_X(destreg, testnum, offset) \
+    TEST_CHECK(destreg, testnum, offset)
+
+#define TEST_CHECK_FS(destreg, testnum, offset) \
+    fmv.x.w x30, destreg; \
+    TEST_CHECK(x30, testnum, offset)
+
+#define TEST_CHECK_FD(destreg, testnum, offset) \
+    fmv.x.d x30, destreg; \
+    TEST_CHECK(x30, testnum, offset)
@@ -9,6 +9,11 @@ import river_core.utils as utils
 from river_core.constants import *
 import random
 import re
+import shlex
+import subprocess
+import tempfile
+import itertools
+import numpy
 import datetime
 import pytest
 from envyaml import EnvYAML
@@ -47,6 +52,9 @@ la x1, begin_rvtest_data
 code_footer = '''rvtest_code_end:
 RVMODEL_HALT'''
 
+# Number of testfloat cases turned into ASM at a time
+chunk_size = 8192
+
 
 def convert_inst_precision(inst):
     '''
@@ -127,8 +135,111 @@ def inst_alignment(inst):
     return inst_align
 
 
-def create_asm(gen_file, parameter_list, gen_cmd):
-    offset_mem = []
+def select_registers(rng, bounds, count, avoid_x1=False, reserved=False):
+    '''
+        Draw the register indices of one operand for every case at once
+
+        :param rng: numpy random generator
+
+        :param bounds: lower and upper bound of the indices (inclusive)
+
+        :param count: number of cases
+
+        :param avoid_x1: redraw index 1 from 4..31, as x1 holds the data
+            pointer
+
+        :param reserved: redraw x0-x3 and x29-x31 from 4..28, as they are
+            used by the self-checking code
+
+        :return: array of register indices
+    '''
+    regs = rng.integers(int(bounds[0]), int(bounds[1]) + 1, count)
+    if avoid_x1:
+        ones = regs == 1
+        regs[ones] = rng.integers(4, 32, int(ones.sum()))
+    if reserved:
+        used = (regs < 4) | (regs > 28)
+        regs[used] = rng.integers(4, 29, int(used.sum()))
+    return regs
+
+
+def data_offsets(start, count, step, max_offset):
+    '''
+        Offsets of the operands of consecutive cases from x1
+
+        The offset grows by step per case. Once it reaches max_offset, x1 is
+        moved forward by max_offset and the offset restarts at step.
+
+        :param start: index of the first case
+
+        :param count: number of cases
+
+        :param step: bytes of data used per case
+
+        :param max_offset: last offset before x1 is moved
+
+        :return: array of offsets
+    '''
+    index = numpy.arange(start, start + count)
+    per_block = max_offset // step
+    return numpy.where(index <= per_block, index,
+                       (index - per_block - 1) % per_block + 1) * step
+
+
+def expected_words(results, flags, sign_extend):
+    '''
+        Data words holding the expected result and flags of the cases
+
+        :param results: hex strings of the expected results
+
+        :param flags: hex strings of the expected exception flags
+
+        :param sign_extend: the result is held sign extended from 32 bits
+            in its 64-bit register
+
+        :return: data directives of the expected results and flags
+    '''
+    words = []
+    for result, flag in zip(results, flags):
+        value = int(result, 16)
+        if sign_extend and value & 0x80000000:
+            value |= 0xffffffff00000000
+        words.append('.dword 0x{0:016x}\n.dword 0x{1}\n'.format(value, flag))
+    return words
+
+
+def tee_lines(lines, path):
+    '''
+        Pass lines through while writing them to a file
+    '''
+    with open(path, 'w') as copy:
+        for line in lines:
+            copy.write(line)
+            yield line
+
+
+def create_asm(gen_file, parameter_list, gen_cmd, gen_lines=None,
+               self_checking=False):
+    '''
+        Create the ASM file of a test from the testfloat cases
+
+        The cases are consumed chunk_size at a time, so that the memory used
+        does not depend on the number of cases.
+
+        :param gen_file: path of the .gen file, the .S and .ld files are
+            created next to it
+
+        :param parameter_list: instruction, operand register ranges and mode
+
+        :param gen_cmd: testfloat_gen command, recorded in the ASM file
+
+        :param gen_lines: iterable over the testfloat cases, read from
+            gen_file when None
+
+        :param self_checking: compare the results and flags with the ones
+            expected by testfloat in the test itself, when supported for the
+            instruction
+    '''
     work_dir = os.path.dirname(os.path.realpath(gen_file))
     local_folder_dir = folder_dir + '/testfloat_plugin/asm/'
 
@@ -147,239 +258,236 @@ def create_asm(gen_file, parameter_list, gen_cmd):
 
     # Get alignment values
     align = inst_alignment(asm_inst)
-    # TODO check if this needs to change
-    # Can come from the inst as well
-    # Create test.S
-    # Clean up the file data
-    with open(gen_file, 'r') as gen_file_data:
+
+    # Instruction types
+    arthematic_inst = ['fadd.', 'fsub.', 'fmul.', 'fdiv.']
+    compare_inst = ['feq.', 'flt.', 'fle.', 'fmin.', 'fmax.']
+    fused_inst = ['fmadd', 'fmsub', 'fnmsub', 'fnmadd']
+    convert_inst = 'cvt'
+    sqrt_inst = 'sqrt'
+
+    # Check macro of the result (None when the instruction can't be checked)
+    # and the columns of the gen file holding the expected result and flags
+    fp_check = {'f32': 'TEST_CHECK_FS', 'f64': 'TEST_CHECK_FD'}
+    sign_extend = False
+
+    # For every instruction type: the macro, the register prefix, range and
+    # x1 avoidance of the destination and source operands, the mode, the
+    # columns of the gen file stored as data, the number of data words
+    # addressed per case and the last offset before x1 is moved.
+    if any(element in asm_inst for element in arthematic_inst):
+        macro = 'TEST_RR_OP'
+        regs = [('f', parameter_list[1], True), ('f', parameter_list[2], False),
+                ('f', parameter_list[3], False)]
+        mode = parameter_list[4]
+        data_columns = [0, 1]
+        operands = 2
+        max_offset = 2048 - (2*align)
+        check = fp_check.get(inst_precision(asm_inst))
+        check_columns = [2, 3]
+        sign_extend = check == 'TEST_CHECK_FS'
+
+    elif sqrt_inst in asm_inst:
+        macro = 'TEST_R_OP'
+        regs = [('f', parameter_list[1], True), ('f', parameter_list[2], False)]
+        mode = parameter_list[3]
+        data_columns = [0]
+        operands = 1
+        max_offset = 2048 - (1*align)
+        check = fp_check.get(inst_precision(asm_inst))
+        check_columns = [1, 2]
+        sign_extend = check == 'TEST_CHECK_FS'
+
+    elif any(element in asm_inst for element in fused_inst):
+        macro = 'TEST_RRR_OP'
+        regs = [('f', parameter_list[1], True), ('f', parameter_list[2], False),
+                ('f', parameter_list[3], False),
+                ('f', parameter_list[4], False)]
+        mode = parameter_list[5]
+        data_columns = [0, 1, 3]
+        operands = 3
+        max_offset = int(2048/(3*align))*(3*align) - (3*align)
+        # testfloat only provides the results of fmadd (mulAdd)
+        check = None
+        if asm_inst.startswith('fmadd'):
+            check = fp_check.get(inst_precision(asm_inst))
+        check_columns = [3, 4]
+        sign_extend = check == 'TEST_CHECK_FS'
+        if self_checking and check:
+            # The addend is needed to get the expected result
+            data_columns = [0, 1, 2]
+
+    elif convert_inst in asm_inst:
+        src_type, dest_type = convert_inst_precision(asm_inst)
+        dest_prefix = 'x' if 'i' in dest_type else 'f'
+        src_prefix = 'x' if 'i' in src_type else 'f'
+        macro = 'TEST_R2_OP' if src_prefix == 'x' else 'TEST_R_OP'
+        # can't select x1 as destination register
+        regs = [(dest_prefix, parameter_list[1], True),
+                (src_prefix, parameter_list[2], False)]
+        mode = parameter_list[3]
+        data_columns = [0, 1]
+        operands = 1
+        max_offset = 2048 - (1*align)
+        if dest_prefix == 'x':
+            check = 'TEST_CHECK_X'
+        else:
+            check = fp_check.get(dest_type)
+        # The operand is loaded with the width of the data words, which
+        # doesn't fit 64-bit integers in words or 32-bit floats in dwords
+        if src_type in ['i64', 'ui64'] and align == 4:
+            check = None
+        if src_type == 'f32' and align == 8:
+            check = None
+        check_columns = [1, 2]
+        sign_extend = dest_type in ['f32', 'i32', 'ui32']
+        if self_checking and check:
+            data_columns = [0]
+
+    elif any(element in asm_inst for element in compare_inst):
+        macro = 'TEST_RR_OP'
+        regs = [('x', parameter_list[1], False),
+                ('f', parameter_list[2], False),
+                ('f', parameter_list[3], False)]
+        if 'eq' in asm_inst:
+            mode = "010"
+        elif ('lt' in asm_inst) or ('max' in asm_inst):
+            mode = "001"
+        elif ('le' in asm_inst) or ('min' in asm_inst):
+            mode = "000"
+        data_columns = [0, 1]
+        operands = 2
+        max_offset = 2048 - (2*align)
+        # fmin/fmax are generated from the feq cases
+        check = None
+        if not (('fmin' in asm_inst) or ('fmax' in asm_inst)):
+            check = 'TEST_CHECK_X'
+        check_columns = [2, 3]
+
+    else:
+        logger.error(
+            'Failed to detect any instructions \nEmpty ASM file will be generated\nExiting the framework'
+        )
+        raise SystemError
+
+    if self_checking and check is None:
+        logger.warning(
+            'Self-checking not supported for {0}, the test needs the reference'
+            .format(asm_inst))
+    checking = self_checking and check is not None
+    if checking:
+        # x1 skips the status word at begin_rvtest_data, x3 points to the
+        # expected results and flags
+        header += 'addi x1, x1, 8\nla x3, rvtest_expected\n'
+
+    # Seeded from random so that seeding it keeps the tests reproducible
+    rng = numpy.random.default_rng(random.getrandbits(64))
+    directive = '.dword 0x' if align == 8 else '.word 0x'
+
+    gen_data = None
+    if gen_lines is None:
         logger.debug('Reading gen files')
-        gen_data = gen_file_data.read().splitlines()
+        gen_data = open(gen_file, 'r')
+        gen_lines = gen_data
+
     # Add steps to write to file
     assembly_file = os.path.splitext(gen_file)[0] + '.S'
-    with open(assembly_file, 'w+') as asm_file_pointer:
+    with open(assembly_file, 'w+') as asm_file_pointer, \
+            tempfile.TemporaryFile('w+', dir=work_dir) as data_file, \
+            tempfile.TemporaryFile('w+', dir=work_dir) as expected_file:
         logger.info('Generating in the ASM file')
         # riscv-gcc uses GAS syntax so need to denote the comments with #
         generation_header = "# ASM file generated by testfloat plugin at {0}, from testfloatgen command: \n# {1} \n".format(
             datetime.datetime.now(), gen_cmd)
-        asm_file_pointer.write(generation_header)
-        asm_file_pointer.write(header)
-
-        # Need to maintain an offset for the values
-        offset_ctr = 0
-
-        # TODO: Will change to original file length after testing
-        # Is useful to control the number of instructions, we can probably step away from the limits for Testfloat
-        for case_index in range(0, len(gen_data)):
-            # for case_index in range(0, len(gen_data)):
-
-            # Instruction types
-
-            arthematic_inst = ['fadd.', 'fsub.', 'fmul.', 'fdiv.']
-            compare_inst = ['feq.', 'flt.', 'fle.', 'fmin.', 'fmax.']
-            fused_inst = ['fmadd', 'fmsub', 'fnmsub', 'fnmadd']
-            convert_inst = 'cvt'
-            sqrt_inst = 'sqrt'
-
-            # TODO: Improve, nested list parsing, regex is a good alt, but need to be pefomant heavy
-            if any(element in asm_inst for element in arthematic_inst):
-                # Move the selection here to ensure max variety in the tests cases
-                dest = random.randint(int(parameter_list[1][0]),
-                                      int(parameter_list[1][1]))
-                if dest == 1:
-                    dest = random.randint(4,31)
-                dest_reg = 'f' + str(dest)
-                reg_1 = random.randint(int(parameter_list[2][0]),
-                                       int(parameter_list[2][1]))
-                reg_1_str = 'f' + str(reg_1)
-                reg_2 = random.randint(int(parameter_list[3][0]),
-                                       int(parameter_list[3][1]))
-                reg_2_str = 'f' + str(reg_2)
-                mode = parameter_list[4]
-                case_data = gen_data[case_index].split(' ')
-                offset_mem.append('0x' + str(case_data[0]))
-                offset_mem.append('0x' + str(case_data[1]))
-                # expected_result = '0x' + str(case_data[2])
-                # exception_flag = '0x' + str(case_data[3])
-                generated_asm_inst = '\ninst_{0}:\nTEST_RR_OP({1}, {2}, {3}, {4}, {5}, {6}, {7})\n'.format(
-                    case_index, asm_inst, dest_reg, reg_1_str, reg_2_str, mode,
-                    offset_ctr, offset_ctr + align)
-
-                asm_file_pointer.write(generated_asm_inst)
-                # Ensure that the offset generated is twice the amount
-                max_offset = 2048 - (2*align)
-
-                # Add check for 2048 limitation
-                if offset_ctr == max_offset:
-                    update_asm_inst = '\naddi x1, x1, {0}\n'.format(max_offset)
-                    asm_file_pointer.write(update_asm_inst)
-                    offset_ctr = 2 * align
-                else:
-                    offset_ctr += 2 * align
-
-            elif sqrt_inst in asm_inst:
-                # Move the selection here to ensure max variety in the tests cases
-                dest = random.randint(int(parameter_list[1][0]),
-                                      int(parameter_list[1][1]))
-                if dest == 1:
-                    dest = random.randint(4,31)
-                dest_reg = 'f' + str(dest)
-                reg_1 = random.randint(int(parameter_list[2][0]),
-                                       int(parameter_list[2][1]))
-                reg_1_str = 'f' + str(reg_1)
-                mode = parameter_list[3]
-                case_data = gen_data[case_index].split(' ')
-                offset_mem.append('0x' + str(case_data[0]))
-                # expected_result = '0x' + str(case_data[2])
-                # exception_flag = '0x' + str(case_data[3])
-                generated_asm_inst = '\ninst_{0}:\nTEST_R_OP({1}, {2}, {3}, {4}, {5})\n'.format(
-                    case_index, asm_inst, dest_reg, reg_1_str, mode, offset_ctr)
-
-                asm_file_pointer.write(generated_asm_inst)
-                max_offset = 2048 - (1*align)
-
-                # Add check for 2048 limitation
-                if offset_ctr == max_offset:
-                    update_asm_inst = '\naddi x1, x1, {0}\n'.format(max_offset)
-                    asm_file_pointer.write(update_asm_inst)
-                    offset_ctr = 1 * align
-                else:
-                    offset_ctr += 1 * align
-
-            elif any(element in asm_inst for element in fused_inst):
-                # Move the selection here to ensure max variety in the tests cases
-                dest = random.randint(int(parameter_list[1][0]),
-                                      int(parameter_list[1][1]))
-                if dest == 1:
-                    dest = random.randint(4,31)
-                dest_reg = 'f' + str(dest)
-                reg_1 = random.randint(int(parameter_list[2][0]),
-                                       int(parameter_list[2][1]))
-                reg_1_str = 'f' + str(reg_1)
-                reg_2 = random.randint(int(parameter_list[3][0]),
-                                       int(parameter_list[3][1]))
-                reg_2_str = 'f' + str(reg_2)
-                reg_3 = random.randint(int(parameter_list[4][0]),
-                                       int(parameter_list[4][1]))
-                reg_3_str = 'f' + str(reg_3)
-                mode = parameter_list[5]
-                case_data = gen_data[case_index].split(' ')
-                offset_mem.append('0x' + str(case_data[0]))
-                offset_mem.append('0x' + str(case_data[1]))
-                offset_mem.append('0x' + str(case_data[3]))
-                # expected_result = '0x' + str(case_data[2])
-                # exception_flag = '0x' + str(case_data[3])
-                generated_asm_inst = '\ninst_{0}:\nTEST_RRR_OP({1}, {2}, {3}, {4}, {5}, {6}, {7}, {8}, {9})\n'.format(
-                    case_index, asm_inst, dest_reg, reg_1_str, reg_2_str,
-                    reg_3_str, mode, offset_ctr, offset_ctr + align,
-                    offset_ctr + 2 * align)
-
-                asm_file_pointer.write(generated_asm_inst)
-                max_offset = int(2048/(3*align))*(3*align) - (3*align)
-
-                # Add check for 2048 limitation
-                if offset_ctr == max_offset:
-                    update_asm_inst = '\naddi x1, x1, {0}\n'.format(max_offset)
-                    asm_file_pointer.write(update_asm_inst)
-                    offset_ctr = 3 * align
-                else:
-                    offset_ctr += 3 * align
-
-            elif convert_inst in asm_inst:
-                # Move the selection here to ensure max variety in the tests cases
-                src_type, dest_type = convert_inst_precision(asm_inst)
-                dest = random.randint(int(parameter_list[1][0]),
-                                      int(parameter_list[1][1]))
-                # can't select x1 as destination register
-                if dest == 1:
-                    dest = random.randint(4,31)
-                if 'i' in dest_type:
-                    dest_reg = 'x' + str(dest)
-                elif 'f' in dest_type:
-                    dest_reg = 'f' + str(dest)
-
-                reg_1 = random.randint(int(parameter_list[2][0]),
-                                       int(parameter_list[2][1]))
-                if 'i' in src_type:
-                    reg_1_str = 'x' + str(reg_1)
-                elif 'f' in src_type:
-                    reg_1_str = 'f' + str(reg_1)
-
-                mode = parameter_list[3]
-                case_data = gen_data[case_index].split(' ')
-                offset_mem.append('0x' + str(case_data[0]))
-                offset_mem.append('0x' + str(case_data[1]))
-                # expected_result = '0x' + str(case_data[2])
-                # exception_flag = '0x' + str(case_data[3])
-                if reg_1_str[0] == 'x':
-                    generated_asm_inst = '\ninst_{0}:\nTEST_R2_OP({1}, {2}, {3}, {4}, {5})\n'.format(
-                        case_index, asm_inst, dest_reg, reg_1_str, mode, offset_ctr)
-                else:
-                    generated_asm_inst = '\ninst_{0}:\nTEST_R_OP({1}, {2}, {3}, {4}, {5})\n'.format(
-                        case_index, asm_inst, dest_reg, reg_1_str, mode, offset_ctr)
-
-                asm_file_pointer.write(generated_asm_inst)
-                max_offset = 2048 - (1*align)
-
-                # Add check for 2048 limitation
-                if offset_ctr == max_offset:
-                    update_asm_inst = '\naddi x1, x1, {0}\n'.format(max_offset)
-                    asm_file_pointer.write(update_asm_inst)
-                    offset_ctr = 1 * align
-                else:
-                    offset_ctr += 1 * align
-
-            elif any(element in asm_inst for element in compare_inst):
-                # Move the selection here to ensure max variety in the tests cases
-                dest = random.randint(int(parameter_list[1][0]),
-                                      int(parameter_list[1][1]))
-                dest_reg = 'x' + str(dest)
-                reg_1 = random.randint(int(parameter_list[2][0]),
-                                       int(parameter_list[2][1]))
-                reg_1_str = 'f' + str(reg_1)
-                reg_2 = random.randint(int(parameter_list[3][0]),
-                                       int(parameter_list[3][1]))
-                reg_2_str = 'f' + str(reg_2)
-                if 'eq' in asm_inst:
-                    mode = "010"
-                elif ('lt' in asm_inst) or ('max' in asm_inst):
-                    mode = "001"
-                elif ('le' in asm_inst) or ('min' in asm_inst):
-                    mode = "000"
-                case_data = gen_data[case_index].split(' ')
-                offset_mem.append('0x' + str(case_data[0]))
-                offset_mem.append('0x' + str(case_data[1]))
-                generated_asm_inst = '\ninst_{0}:\nTEST_RR_OP({1}, {2}, {3}, {4}, {5}, {6}, {7})\n'.format(
-                    case_index, asm_inst, dest_reg, reg_1_str, reg_2_str, mode,
-                    offset_ctr, offset_ctr + align)
-
-                asm_file_pointer.write(generated_asm_inst)
-                max_offset = 2048 - (2*align)
-
-                # Add check for 2048 limitation
-                if offset_ctr == max_offset:
-                    update_asm_inst = '\naddi x1, x1, {0}\n'.format(max_offset)
-                    asm_file_pointer.write(update_asm_inst)
-                    offset_ctr = 2 * align
-                else:
-                    offset_ctr += 2 * align
-
-            else:
+        if checking:
+            generation_header += '# Self-checking test\n'
+        asm_file_pointer.write(generation_header + header)
+
+        # The code of each chunk goes to the ASM file right away, its data is
+        # spooled until the code section is complete.
+        case_start = 0
+        while True:
+            chunk = list(itertools.islice(gen_lines, chunk_size))
+            if not chunk:
+                break
+            count = len(chunk)
+            try:
+                case_data = numpy.array(''.join(chunk).split(),
+                                        dtype=str).reshape(count, -1)
+            except ValueError:
                 logger.error(
-                    'Failed to detect any instructions \nEmpty ASM file will be generated\nExiting the framework'
-                )
+                    'Malformed testfloat output for {0}'.format(gen_file))
                 raise SystemError
 
+            offsets = data_offsets(case_start, count, operands * align,
+                                   max_offset)
+            # x1 is moved past the data of the cases reaching max_offset
+            rebase = [
+                '\naddi x1, x1, {0}\n'.format(max_offset) if moved else ''
+                for moved in (offsets == max_offset).tolist()
+            ]
+            columns = []
+            for prefix, bounds, avoid_x1 in regs:
+                indices = select_registers(rng, bounds, count, avoid_x1,
+                                           checking and prefix == 'x')
+                columns.append([prefix + str(reg) for reg in indices.tolist()])
+            columns.append([str(mode)] * count)
+            columns += [(offsets + i * align).astype(str).tolist()
+                        for i in range(operands)]
+            cases = ['{0}({1}, {2})\n'.format(macro, asm_inst, ', '.join(ops))
+                     for ops in zip(*columns)]
+
+            if checking:
+                # The expected result and flags take two dwords per case, x3
+                # is moved like x1
+                expected_offsets = data_offsets(case_start, count, 16, 2032)
+                cases = [
+                    'TEST_CLEAR_FLAGS\n{0}{1}({2}, {3}, {4})\n{5}'.format(
+                        case, check, dest, case_index + 1, offset,
+                        '\naddi x3, x3, 2032\n' if offset == 2032 else '')
+                    for case_index, (case, dest, offset) in enumerate(
+                        zip(cases, columns[0], expected_offsets.tolist()),
+                        case_start)
+                ]
+                expected_file.write(''.join(
+                    expected_words(case_data[:, check_columns[0]].tolist(),
+                                   case_data[:, check_columns[1]].tolist(),
+                                   sign_extend)))
+
+            asm_file_pointer.write(''.join(
+                '\ninst_{0}:\n{1}{2}'.format(case_index, case, addi)
+                for case_index, (case, addi) in enumerate(
+                    zip(cases, rebase), case_start)))
+
+            # The data words of every case, in order
+            data_file.write(''.join(
+                directive + value + '\n'
+                for value in case_data[:, data_columns].ravel().tolist()))
+            case_start += count
+
+        if gen_data is not None:
+            gen_data.close()
+
+        if checking:
+            # A failing check stores its case number in the status word,
+            # which is dumped as the signature
+            asm_file_pointer.write(
+                '\nj rvtest_code_end\nrvtest_fail:\n'
+                'la x31, begin_rvtest_data\nsd x29, 0(x31)\n')
         # Finish the code section
         asm_file_pointer.write(code_footer + '\n\n')
         # Need to write the offsets here
         data_header = '.data\n.align {0}\n.globl begin_rvtest_data\nbegin_rvtest_data:\n'.format(
             align)
+        if checking:
+            data_header += '.dword 0\n'
         asm_file_pointer.write(data_header)
-        for memory in offset_mem:
-            if align==8:
-                asm_file_pointer.write('.dword ' + str(memory) + '\n')
-            else:
-                asm_file_pointer.write('.word ' + str(memory) + '\n')
+        data_file.seek(0)
+        shutil.copyfileobj(data_file, asm_file_pointer)
+        if checking:
+            asm_file_pointer.write('.align 3\nrvtest_expected:\n')
+            expected_file.seek(0)
+            shutil.copyfileobj(expected_file, asm_file_pointer)
         asm_file_pointer.write(
             '.align {0}; .global end_rvtest_data; end_rvtest_data:\n'.format(
                 align))
@@ -403,6 +511,11 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
     setup_dir = ''
     testfloat_bin = ''
     run_command = []
+    # Keep the testfloat output in <test>.gen, for debugging
+    keep_gen = bool(inst_yaml_list.get('keep_gen', False))
+    # Check the results within the tests, so that they don't need the
+    # reference model
+    self_checking = bool(inst_yaml_list.get('self_checking', False))
 
     for key, value in inst_yaml_list.items():
         if key == 'gen_binary_path':
@@ -436,6 +549,16 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
                 param_list.append(reg1)
                 tests_per_instruction = int(
                     inst_yaml_list[key]['tests_per_instruction'])
+                # Split the cases of every test into shards, each being a
+                # test of its own. No shard is left without cases, and the
+                # remainder is spread over the first shards.
+                shards = max(
+                    1,
+                    min(int(inst_yaml_list[key].get('shards', 1)),
+                        tests_per_instruction))
+                shard_size, extra = divmod(tests_per_instruction, shards)
+                shard_sizes = [shard_size + 1] * extra + [shard_size] * (
+                    shards - extra)
 
                 # Get inst info
                 arthematic_inst = ['fadd.', 'fsub.', 'fmul.', 'fdiv.']
@@ -527,19 +650,29 @@ def gen_cmd_list(gen_config, seed, count, output_dir, module_dir):
                                 output_inst = inst.replace('.', '_')
                                 gen_prefix = '{0:06}_{1}'.format(
                                     gen_seed, now.strftime('%d%m_%H%M%S'))
-                                test_prefix = 'testfloat_{0}_{1}_{2}_{3}_{4}'.format(
-                                    key, output_inst, rounding_mode_str,
-                                    num_index, gen_prefix)
-                                testdir = '{0}/asm/{1}/'.format(
-                                    dirname, test_prefix)
+                                gen_files = []
+                                testdirs = []
+                                for shard_index in range(shards):
+                                    test_num = str(num_index)
+                                    if shards > 1:
+                                        test_num += 's' + str(shard_index)
+                                    test_prefix = 'testfloat_{0}_{1}_{2}_{3}_{4}'.format(
+                                        key, output_inst, rounding_mode_str,
+                                        test_num, gen_prefix)
+                                    testdir = '{0}/asm/{1}/'.format(
+                                        dirname, test_prefix)
+                                    gen_files.append(testdir + test_prefix +
+                                                     '.gen')
+                                    testdirs.append(testdir)
 
                                 combine = [
                                     '{0} -seed {1} -n {2} {3} {4}'.format(
                                         testfloat_bin, gen_seed,
                                         tests_per_instruction,
                                         rounding_mode_gen, gen_inst),
-                                    param_list, testdir + test_prefix + '.gen',
-                                    testdir
+                                    param_list, gen_files, testdirs, keep_gen,
+                                    self_checking,
+                                    shard_sizes
                                 ]
                                 run_command.append(combine)
 
@@ -571,10 +704,32 @@ def test_input(request):
     logger.debug('Generating commands from test_input fixture')
     generation_param = request.param
     # This part needs to be done here as the file processing part can't be done inside gen_cmd
-    os.makedirs(generation_param[3], exist_ok=True)
-    (ret, out, err) = utils.sys_command_file(generation_param[0],
-                                             generation_param[2])
-    create_asm(generation_param[2], generation_param[1], generation_param[0])
+    for testdir in generation_param[3]:
+        os.makedirs(testdir, exist_ok=True)
+    # The cases are turned into ASM while testfloat_gen produces them, each
+    # shard taking the next cases
+    logger.debug(generation_param[0])
+    with tempfile.TemporaryFile('w+') as err_file:
+        process = subprocess.Popen(shlex.split(generation_param[0]),
+                                   stdout=subprocess.PIPE,
+                                   stderr=err_file,
+                                   universal_newlines=True)
+        try:
+            for gen_file, shard_size in zip(generation_param[2],
+                                            generation_param[6]):
+                gen_lines = itertools.islice(process.stdout, shard_size)
+                if generation_param[4]:
+                    gen_lines = tee_lines(gen_lines, gen_file)
+                create_asm(gen_file, generation_param[1], generation_param[0],
+                           gen_lines, generation_param[5])
+        except BaseException:
+            process.kill()
+            process.wait()
+            raise
+        process.stdout.close()
+        ret = process.wait()
+        err_file.seek(0)
+        err = err_file.read()
     return ret, err
 
 
@@ -76,6 +76,12 @@ class testfloat_plugin(object):
 
         output_dir = os.path.abspath(output_dir)
 
+        # The self-checking code compares 64-bit registers
+        gen_yaml = utils.load_yaml(self.gen_config)
+        if gen_yaml.get('self_checking', False) and '64' not in self.isa:
+            logger.error('self_checking is only supported for RV64')
+            raise SystemExit
+
         report_file_name = '{0}/{1}_{2}'.format(
             self.json_dir, self.name,
             datetime.datetime.now().strftime("%Y%m%d-%H%M"))
@@ -144,6 +150,12 @@ class testfloat_plugin(object):
             test_list[base_key]['extra_compile'] = []
             test_list[base_key]['compile_macros'] = ['FSZ='+str(fsize)]
             test_list[base_key]['result'] = 'Unavailable'
+            # river_core checks self-checking tests with the signature of the
+            # DUT and doesn't need the reference model
+            with open(test, 'r') as asm:
+                header = [asm.readline() for index in range(3)]
+            test_list[base_key]['self_checking'] = \
+                '# Self-checking test\n' in header
 
         return test_list
 
@@ -0,0 +1,217 @@
+# See LICENSE for details
+'''
+    Compare two commit logs and report the first divergent instruction.
+
+    Usage: python3 compare_dumps.py [--report <file>] [--context <N>]
+                <dut.dump> <ref.dump>
+
+    Both dumps are memory-mapped and compared in large blocks. Only around
+    the first differing block are lines parsed, and they are compared
+    ignoring case and white space like "diff -iw". The report holds the
+    line number, PC, instruction and register/memory updates of both sides
+    at the first divergence along with the preceding and following lines.
+
+    The exit status is 0 when the dumps match, 1 when they differ and 2 on
+    errors, like diff.
+'''
+
+import argparse
+import mmap
+import os
+import re
+import sys
+
+block_size = 1 << 20
+
+commit_re = re.compile(
+    r'core\s+(?P<core>\d+):\s+(?P<priv>\d+)\s+(?P<pc>0x[0-9a-fA-F]+)\s+'
+    r'\((?P<instr>0x[0-9a-fA-F]+)\)(?P<updates>.*)')
+
+
+def normalise(line):
+    '''
+        Canonical form of a line, matching "diff -iw"
+    '''
+    return b''.join(line.split()).lower()
+
+
+def open_dump(path):
+    '''
+        Memory-map a dump, empty files are returned as empty bytes
+
+        :param path: path of the dump
+
+        :return: mmap or bytes object with the contents of the dump
+    '''
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_line(data, pos):
+    '''
+        Line starting at pos along with the position of the next line
+
+        :return: tuple of the line (None at the end of data) and next position
+    '''
+    if pos >= len(data):
+        return None, pos
+    end = data.find(b'\n', pos)
+    if end < 0:
+        end = len(data)
+    return data[pos:end], end + 1
+
+
+def first_difference(dut, ref):
+    '''
+        Find the first pair of lines which differ
+
+        :param dut: contents of the DUT dump
+
+        :param ref: contents of the reference dump
+
+        :return: None when the dumps match, else a tuple of the 1-based line
+            number and the offsets of that line in both dumps
+
+        :rtype: tuple
+    '''
+    dut_pos = ref_pos = 0
+    line = 1
+    while True:
+        # Both dumps are identical up to here at the same offset, so whole
+        # blocks can be compared as raw bytes.
+        while dut_pos == ref_pos:
+            dut_block = dut[dut_pos:dut_pos + block_size]
+            ref_block = ref[ref_pos:ref_pos + block_size]
+            if dut_block == ref_block:
+                if not dut_block:
+                    return None
+                line += dut_block.count(b'\n')
+                dut_pos += len(dut_block)
+                ref_pos = dut_pos
+                continue
+            common = len(os.path.commonprefix([dut_block, ref_block]))
+            # Blocks are cut at fixed offsets, so the line holding the first
+            # differing byte may start in a preceding block.
+            start = dut.rfind(b'\n', 0, dut_pos + common) + 1
+            line += dut[dut_pos:start].count(b'\n')
+            block_end = dut_pos + max(len(dut_block), len(ref_block))
+            dut_pos = start
+            ref_pos = dut_pos
+            break
+
+        # Compare lines until they differ beyond case and white space or the
+        # dumps are aligned again past the block which differed.
+        while True:
+            dut_line, dut_next = read_line(dut, dut_pos)
+            ref_line, ref_next = read_line(ref, ref_pos)
+            if dut_line is None and ref_line is None:
+                return None
+            if dut_line is None or ref_line is None or \
+                    normalise(dut_line) != normalise(ref_line):
+                return line, dut_pos, ref_pos
+            line += 1
+            dut_pos, ref_pos = dut_next, ref_next
+            if dut_pos == ref_pos and dut_pos >= block_end:
+                break
+
+
+def context_before(data, pos, count):
+    '''
+        Lines preceding the line at pos
+    '''
+    start = pos
+    for i in range(count):
+        if start == 0:
+            break
+        start = data.rfind(b'\n', 0, start - 1) + 1
+    return data[start:pos].decode(errors='replace').splitlines()
+
+
+def context_after(data, pos, count):
+    '''
+        Line at pos followed by up to count lines
+    '''
+    lines = []
+    for i in range(count + 1):
+        line, pos = read_line(data, pos)
+        if line is None:
+            break
+        lines.append(line.decode(errors='replace'))
+    return lines
+
+
+def describe(line):
+    '''
+        Human readable description of a commit log line
+    '''
+    if line is None:
+        return 'end of log'
+    match = commit_re.search(line)
+    if match is None:
+        return line
+    return 'pc {0} instr {1} priv {2} updates: {3}'.format(
+        match.group('pc'), match.group('instr'), match.group('priv'),
+        match.group('updates').strip() or '-')
+
+
+def report_difference(dut, ref, difference, context):
+    '''
+        Create the report of the first divergence
+
+        :return: report text
+
+        :rtype: str
+    '''
+    line, dut_pos, ref_pos = difference
+    dut_lines = context_after(dut, dut_pos, context)
+    ref_lines = context_after(ref, ref_pos, context)
+    dut_line = dut_lines[0] if dut_lines else None
+    ref_line = ref_lines[0] if ref_lines else None
+
+    report = ['First divergence at line {0}'.format(line)]
+    report.append('DUT: ' + describe(dut_line))
+    report.append('REF: ' + describe(ref_line))
+    report.append('')
+    report.append('Preceding lines:')
+    report += ['  ' + x for x in context_before(ref, ref_pos, context)]
+    report.append('Following lines in DUT:')
+    report += ['  ' + x for x in dut_lines]
+    report.append('Following lines in REF:')
+    report += ['  ' + x for x in ref_lines]
+    return '\n'.join(report) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare commit logs')
+    parser.add_argument('dut', help='DUT dump')
+    parser.add_argument('ref', help='reference dump')
+    parser.add_argument('--report', help='file receiving the report')
+    parser.add_argument('--context', type=int, default=5,
+                        help='lines of context in the report')
+    args = parser.parse_args()
+
+    try:
+        dut = open_dump(args.dut)
+        ref = open_dump(args.ref)
+    except OSError as e:
+        sys.stderr.write(str(e) + '\n')
+        return 2
+
+    difference = first_difference(dut, ref)
+    if difference is None:
+        report = 'Dumps match\n'
+    else:
+        report = report_difference(dut, ref, difference, args.context)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(report)
+    else:
+        sys.stdout.write(report)
+    return 0 if difference is None else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,18 +3,53 @@
 import os
 import sys
 import pluggy
+import importlib.util
 import shutil
 import random
 import re
 import glob
 import datetime
+import json
 import pytest
+import hashlib
 
 from river_core.log import logger
 from river_core.utils import *
 
 dut_hookimpl = pluggy.HookimplMarker('dut')
 
+# Test scheduling shared by the plugins, an identical copy of scheduling.py
+# is kept next to every plugin
+scheduling_spec = importlib.util.spec_from_file_location(
+    __name__ + '_scheduling',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scheduling.py'))
+scheduling = importlib.util.module_from_spec(scheduling_spec)
+scheduling_spec.loader.exec_module(scheduling)
+
+
+def spike_hash():
+    '''
+        Function to identify the spike installation in use
+
+        :return: hex digest over the spike binary and its shared libraries
+
+        :rtype: str
+    '''
+    spike = os.path.realpath(shutil.which('spike'))
+    prefix = os.path.dirname(os.path.dirname(spike))
+    paths = [spike]
+    for lib in ['riscv', 'fesvr', 'softfloat', 'disasm', 'customext']:
+        paths += sorted(glob.glob(prefix + '/lib/lib' + lib + '.so*'))
+    hasher = hashlib.sha256()
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        hasher.update(os.path.basename(path).encode() + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
 
 class spike_plugin(object):
     '''
@@ -38,14 +73,21 @@ class spike_plugin(object):
             self.xlen = 32
         self.elf = 'ref.elf'
 
-        self.objdump_cmd = ''#riscv{0}-unknown-elf-objdump -D ref.elf > ref.disass && '.format( self.xlen)
+        self.objdump_cmd = ''#riscv{0}-unknown-elf-objdump -D ref.elf > ref.disass'.format( self.xlen)
         self.sim_cmd = 'spike'
         self.sim_args = '--log ref.dump --log-commits --priv={0} --isa={1} {2}'
 
+        # Tests are compiled once into a shared ELF in the test work_dir which
+        # is reused by the other plugins running the same test.
+        self.compile_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link ref.elf --'
         self.work_dir = os.path.abspath(work_dir) + '/'
         self.test_list = load_yaml(test_list)
 
         self.json_dir = self.work_dir + '/.json/'
+        # Runtimes of the tests in previous runs, used to schedule them
+        self.history_file = self.json_dir + 'history_' + self.name + '.json'
         # Check if dir exists
         if (os.path.isdir(self.json_dir)):
             logger.debug(self.json_dir + ' Directory exists')
@@ -56,6 +98,82 @@ class spike_plugin(object):
             logger.error('Spike not available in $PATH')
             raise SystemExit
 
+        # In lockstep mode the DUT plugin runs spike alongside the simulator
+        # and writes ref.dump itself
+        if 'lockstep' in ini_config:
+            self.lockstep = str_2_bool(ini_config['lockstep'])
+        else:
+            self.lockstep = False
+
+        # Write diff.report with the first divergence between dut.dump and
+        # ref.dump of every test. The report does not affect the result.
+        if 'diff_report' in ini_config:
+            self.diff_report = str_2_bool(ini_config['diff_report'])
+        else:
+            self.diff_report = False
+        self.diff_report_cmd = '(python3 {0} '.format(os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'compare_dumps.py'))
+        self.diff_report_cmd += '--report diff.report dut.dump ref.dump ; true)'
+
+        # Spike is deterministic, so the ref.dump of a test can be restored
+        # from a persistent cache keyed on the ELF, the spike arguments and
+        # the spike installation.
+        if 'result_cache' in ini_config:
+            self.result_cache = str_2_bool(ini_config['result_cache'])
+        else:
+            self.result_cache = False
+        if 'cache_dir' in ini_config:
+            self.cache_dir = os.path.abspath(ini_config['cache_dir'])
+        else:
+            self.cache_dir = os.path.abspath(work_dir) + '/.cache'
+        if 'cache_size' in ini_config:
+            self.cache_size = int(ini_config['cache_size'])
+        else:
+            self.cache_size = 10240
+        self.result_cache_script = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), 'result_cache.py')
+        # The ELFs of static suites, whose sources are the same in every
+        # regression, are also kept in a persistent cache bounded to
+        # elf_cache_size MB
+        if 'elf_cache' in ini_config:
+            self.elf_cache = str_2_bool(ini_config['elf_cache'])
+        else:
+            self.elf_cache = True
+        if 'elf_cache_generators' in ini_config:
+            self.elf_cache_generators = [
+                x.strip() for x in ini_config['elf_cache_generators'].split(',')
+            ]
+        else:
+            self.elf_cache_generators = ['riscv_tests', 'riscof', 'ctg']
+        if 'elf_cache_size' in ini_config:
+            self.elf_cache_size = int(ini_config['elf_cache_size'])
+        else:
+            self.elf_cache_size = 2048
+        self.elf_cache_dir = os.path.join(self.cache_dir, 'elf')
+        self.elf_cache_script = 'python3 ' + os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            'elf_compile.py') + ' --link ref.elf --cache {0} --'.format(
+                self.elf_cache_dir)
+        if self.result_cache and not self.lockstep:
+            self.ref_cache = os.path.join(self.cache_dir, 'spike')
+            self.sim_cmd = 'python3 {0} run --cache {1} --salt {2} '.format(
+                self.result_cache_script, self.ref_cache, spike_hash())
+            self.sim_cmd += '--input {0} --output ref.dump -- spike'.format(
+                self.elf)
+        # Run the tests which failed in the previous run and the smoke tests
+        # (comma separated fnmatch patterns of test names) ahead of the
+        # regression, in a pytest session of their own
+        if 'fast_feedback' in ini_config:
+            self.fast_feedback = str_2_bool(ini_config['fast_feedback'])
+        else:
+            self.fast_feedback = False
+        if 'smoke' in ini_config:
+            self.smoke = [
+                x.strip() for x in ini_config['smoke'].split(',') if x.strip()
+            ]
+        else:
+            self.smoke = []
+
     @dut_hookimpl
     def build(self):
         logger.debug('Build Hook')
@@ -63,9 +181,18 @@ class spike_plugin(object):
             self.name))
         make.makeCommand = 'make -j1'
         self.make_file = os.path.join(self.work_dir, 'Makefile.' + self.name)
+        self.cmd_file = os.path.join(self.work_dir,
+                                     'commands.' + self.name + '.json')
+        self.key_file = os.path.join(self.work_dir,
+                                     'tests.' + self.name + '.list')
         self.test_names = []
+        test_commands = {}
 
         for test, attr in self.test_list.items():
+            # river_core checks self-checking tests with the signature of the
+            # DUT, they need no reference dump
+            if attr.get('self_checking', False):
+                continue
             logger.debug('Creating Make Target for ' + str(test))
             abi = attr['mabi']
             arch = attr['march']
@@ -96,21 +223,42 @@ class spike_plugin(object):
                 spike_priv += 'u'
 
             ch_cmd = 'cd {0} && '.format(work_dir)
-            compile_cmd = '{0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
+            compile_script = self.compile_script
+            if self.elf_cache and \
+                    attr.get('generator') in self.elf_cache_generators:
+                compile_script = self.elf_cache_script
+            compile_cmd = compile_script + \
+                    ' {0} {1} -march={2} -mabi={3} {4} {5} {6}'.format(\
                     cc, cc_args, arch, abi, link_args, link_file, asm_file)
             for x in attr['extra_compile']:
                 compile_cmd += ' ' + x
             for x in attr['include']:
                 compile_cmd += ' -I '+str(x)
             compile_cmd += ' '.join(map(' -D{0}'.format, attr['compile_macros']))
-            compile_cmd += ' -o ref.elf && '
             post_process_cmd = ''
-            target_cmd = ch_cmd + compile_cmd + self.objdump_cmd +\
-                    self.sim_cmd + ' ' + \
-                    self.sim_args.format(spike_priv, spike_isa, self.elf)
+            # Stages of the test, each run from the work_dir of the test
+            if self.lockstep:
+                stages = [['check', 'test -f ref.dump']]
+            else:
+                stages = [['compile', compile_cmd]]
+                if self.objdump_cmd:
+                    stages.append(['objdump', self.objdump_cmd])
+                stages.append(['simulate', self.sim_cmd + ' ' +
+                               self.sim_args.format(spike_priv, spike_isa,
+                                                    self.elf)])
+            if self.diff_report:
+                stages.append(['diff_report', self.diff_report_cmd])
+            target_cmd = ch_cmd + ' && '.join(cmd for stage, cmd in stages)
             make.add_target(target_cmd, test)
+            test_commands[test] = {'work_dir': work_dir, 'stages': stages}
             self.test_names.append(test)
 
+        with open(self.cmd_file, 'w') as cmd_file:
+            json.dump(test_commands, cmd_file)
+        # Manifest of the tests to run, one name per line
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
     @dut_hookimpl
     def run(self, module_dir):
         logger.debug('Run Hook')
@@ -118,26 +266,55 @@ class spike_plugin(object):
         pytest_file = module_dir + '/spike_plugin/gen_framework.py'
         logger.debug('Pytest file: {0}'.format(pytest_file))
 
+        # Dispatch the tests with the longest expected runtime first
+        self.test_names = scheduling.order_tests(self.test_names,
+                                                 self.test_list,
+                                                 self.history_file)
+        with open(self.key_file, 'w') as key_file:
+            key_file.write(''.join(test + '\n' for test in self.test_names))
+
         report_file_name = '{0}/{1}_{2}'.format(
             self.json_dir, self.name,
             datetime.datetime.now().strftime("%Y%m%d-%H%M"))
+        priority = []
+        if self.fast_feedback:
+            priority = scheduling.priority_tests(
+                self.test_names, self.json_dir, self.name,
+                os.path.join(self.work_dir, 'failed_list.yaml'), self.smoke)
 
         # TODO Regression list currently removed, check back later
         # TODO The logger doesn't exactly work like in the pytest module
-        pytest.main([
+        pytest_args = [
             pytest_file,
             '-n={0}'.format(self.jobs),
             '-k={0}'.format(self.filter),
             '--html={0}.html'.format(self.work_dir + '/reports/' + self.name),
             '--report-log={0}.json'.format(report_file_name),
             '--work_dir={0}'.format(self.work_dir),
-            '--make_file={0}'.format(self.make_file),
-            '--key_list={0}'.format(self.test_names),
+            '--cmd_file={0}'.format(self.cmd_file),
+            '--key_file={0}'.format(self.key_file),
             # TODO Debug parameters, remove later on
             '--log-cli-level=DEBUG',
             '-o log_cli=true'
-        ])
+        ]
+        scheduling.run_priority_first(
+            pytest_args, report_file_name, self.key_file, self.test_names,
+            priority)
         # , '--regress_list={0}'.format(self.regress_list), '-v', '--compile_config={0}'.format(compile_config),
+        if self.result_cache and not self.lockstep:
+            logger.debug('Limiting spike result cache to {0} MB'.format(
+                self.cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                self.result_cache_script, self.ref_cache, self.cache_size))
+        if self.elf_cache:
+            logger.debug('Limiting ELF cache to {0} MB'.format(
+                self.elf_cache_size))
+            sys_command('python3 {0} evict --cache {1} --max-size {2}'.format(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'result_cache.py'), self.elf_cache_dir,
+                self.elf_cache_size))
+        scheduling.record_durations(report_file_name + '.json',
+                                    self.history_file, self.test_list)
         return report_file_name
 
     @dut_hookimpl
@@ -0,0 +1,77 @@
+# See LICENSE for details
+
+import importlib.util
+import os
+import random
+
+import pytest
+
+compare_dumps_spec = importlib.util.spec_from_file_location(
+    'compare_dumps',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                 'reference_plugins', 'spike_plugin', 'compare_dumps.py'))
+compare_dumps = importlib.util.module_from_spec(compare_dumps_spec)
+compare_dumps_spec.loader.exec_module(compare_dumps)
+
+
+def line_by_line(dut, ref):
+    '''
+        First difference found by comparing every line like "diff -iw"
+    '''
+    dut_lines = dut.split(b'\n')
+    ref_lines = ref.split(b'\n')
+    dut_pos = ref_pos = 0
+    for index in range(max(len(dut_lines), len(ref_lines))):
+        dut_line = dut_lines[index] if index < len(dut_lines) else None
+        ref_line = ref_lines[index] if index < len(ref_lines) else None
+        if dut_line == b'' and dut_pos >= len(dut):
+            dut_line = None
+        if ref_line == b'' and ref_pos >= len(ref):
+            ref_line = None
+        if dut_line is None and ref_line is None:
+            return None
+        if dut_line is None or ref_line is None or \
+                compare_dumps.normalise(dut_line) != \
+                compare_dumps.normalise(ref_line):
+            return index + 1, dut_pos, ref_pos
+        dut_pos += len(dut_line) + 1
+        ref_pos += len(ref_line) + 1
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(compare_dumps, 'block_size', 8)
+
+
+def test_divergence_straddling_block(small_blocks):
+    # The second line starts in the first block and differs before the
+    # first newline of the second block
+    dut = b'core 0\ncore 0: 3 0x1000\n'
+    ref = b'core 0\ncore 0: 3 0x2000\n'
+    assert compare_dumps.first_difference(dut, ref) == (2, 7, 7)
+
+
+def test_case_and_space_straddling_block(small_blocks):
+    dut = b'core 0\ncore 0:  3 0xABCD\n'
+    ref = b'core 0\ncore 0: 3 0xabcd\n'
+    assert compare_dumps.first_difference(dut, ref) is None
+
+
+def test_random_dumps(small_blocks):
+    rand = random.Random(0)
+    lines = [b'core 0: 3 0x80000000 (0x00000013)', b'x1 0x0', b'mem 0x10']
+    for i in range(2000):
+        ref = [rand.choice(lines) for j in range(rand.randint(0, 6))]
+        dut = list(ref)
+        for j in range(rand.randint(0, 2)):
+            if not dut:
+                break
+            index = rand.randrange(len(dut))
+            dut[index] = rand.choice([
+                dut[index].upper(), dut[index].replace(b' ', b'  '),
+                rand.choice(lines), dut[index] + b'1'
+            ])
+        dut = b''.join(x + b'\n' for x in dut)
+        ref = b''.join(x + b'\n' for x in ref)
+        assert compare_dumps.first_difference(dut, ref) == \
+            line_by_line(dut, ref)